@@ -0,0 +1,212 @@
+# Copyright (C) 2026 Zurich Instruments
+#
+# This software may be modified and distributed under the terms
+# of the MIT license. See the LICENSE file for details.
+
+"""Benchmark of the host-side overhead of HDAWG_Core
+
+Runs against Mock_DAQ_Server, so that no instrument is needed, or against a
+real data server. The compile time (source generation and compilation) and
+the upload time (ELF, waveforms and command table transfer) of each
+iteration are measured with Phase_Timer, and saved in the same format as the
+AWG Compiler Benchmarking notebook: `compile_time_<name>.txt`,
+`upload_time_<name>.txt` and `params.txt` with n and k.
+"""
+
+import numpy as np
+import argparse, os, tempfile
+
+from hdawg_utils import HDAWG_Core, CommandTable, Phase_Timer
+from hdawg_mock import Mock_DAQ_Server, Latency_Model
+
+# length of a single pulse, in samples
+PULSE_LEN = 256
+
+def _pulse(rng, n=1):
+    """n pulses of random amplitude and phase, as I and Q"""
+    x = np.linspace(-1, 1, PULSE_LEN)
+    env = np.exp(-x**2 / (1/3)**2)
+    amp = rng.uniform(-1, 1, n) * np.exp(1j * rng.uniform(0, 2*np.pi, n))
+    wave = np.outer(amp, env).ravel()
+    return wave.real, wave.imag
+
+def _timed_config(core, program, ct=None, waves=None):
+    """Configure the core, return the compile and upload time in seconds
+
+    The compilation is forced, since the same program is loaded again in
+    every iteration of a size.
+    """
+    core.timer.reset()
+    core.config(program, ct=ct, waves=waves, force=True)
+    summary = core.timer.summary()
+    total = lambda *phases: sum(summary[phase]['total'] for phase in phases if phase in summary)
+    return total('source', 'compile'), total('elf_transfer', 'wave_transfer', 'ct_transfer')
+
+def bench_flat_wfm(core, n, k, csv, seed=None):
+    """Sequences of 2^1 ... 2^n pulses as a single flat waveform
+
+    Parameters
+    ----------
+    core: HDAWG_Core
+        The AWG core, with a timer
+    n: int
+        Number of sequence lengths
+    k: int
+        Number of random sequences per length
+    csv: bool
+        If the waveform is read from CSV files (True) or uploaded into a
+        placeholder (False)
+
+    Returns
+    -------
+    np.array, np.array
+        Compile and upload time of each iteration
+    """
+    rng = np.random.default_rng(seed)
+    waves_dir = os.path.join(core.awg_module.getString('directory'), 'awg', 'waves')
+    os.makedirs(waves_dir, exist_ok=True)
+
+    compile_time, upload_time = [], []
+    for len_exp in range(1, n + 1):
+        for _ in range(k):
+            wI, wQ = _pulse(rng, 2**len_exp)
+            if csv:
+                np.savetxt(os.path.join(waves_dir, 'wI.csv'), wI)
+                np.savetxt(os.path.join(waves_dir, 'wQ.csv'), wQ)
+                program = 'wave wI = "wI";\nwave wQ = "wQ";\nplayWave(1, wI, 2, wQ);\n'
+                times = _timed_config(core, program)
+            else:
+                program = (f'wave wI = placeholder({wI.size:d});\nwave wQ = placeholder({wQ.size:d});\n'
+                           'assignWaveIndex(1, wI, 2, wQ, 0);\nplayWave(1, wI, 2, wQ);\n')
+                times = _timed_config(core, program, waves=[(wI, wQ)])
+            compile_time.append(times[0])
+            upload_time.append(times[1])
+    return np.array(compile_time), np.array(upload_time)
+
+def bench_waveforms(core, n, k, seed=None):
+    """Programs with 2^1 ... 2^n placeholder waveforms of one pulse each
+
+    Parameters and return values as `bench_flat_wfm`
+    """
+    rng = np.random.default_rng(seed)
+    compile_time, upload_time = [], []
+    for len_exp in range(1, n + 1):
+        n_waves = 2**len_exp
+        program = ''.join(f'wave w{i:d} = placeholder({PULSE_LEN:d});\n'
+                          f'assignWaveIndex(1, w{i:d}, 2, w{i:d}, {i:d});\n' for i in range(n_waves))
+        program += ''.join(f'playWave(1, w{i:d}, 2, w{i:d});\n' for i in range(n_waves))
+        for _ in range(k):
+            waves = [_pulse(rng) for _ in range(n_waves)]
+            times = _timed_config(core, program, waves=waves)
+            compile_time.append(times[0])
+            upload_time.append(times[1])
+    return np.array(compile_time), np.array(upload_time)
+
+def bench_command_table(core, n, k, seed=None):
+    """Command tables of 2^1 ... 2^n entries, playing one waveform with
+    random amplitude and phase
+
+    Parameters and return values as `bench_flat_wfm`
+    """
+    rng = np.random.default_rng(seed)
+    compile_time, upload_time = [], []
+    for len_exp in range(1, n + 1):
+        n_entries = min(2**len_exp, CommandTable.max_entries)
+        program = (f'wave w = placeholder({PULSE_LEN:d});\nassignWaveIndex(1, w, 2, w, 0);\n'
+                   f'var i;\nfor (i = 0; i < {n_entries:d}; i++) {{\n  executeTableEntry(i);\n}}\n')
+        for _ in range(k):
+            ct = CommandTable()
+            index = np.arange(n_entries)
+            ct.set(index, waveform=0, phase0=rng.uniform(0, 360, n_entries), phase1=rng.uniform(0, 360, n_entries),
+                   amplitude0=rng.uniform(-1, 1, n_entries), amplitude1=rng.uniform(-1, 1, n_entries))
+            times = _timed_config(core, program, ct=ct, waves=[_pulse(rng)])
+            compile_time.append(times[0])
+            upload_time.append(times[1])
+    return np.array(compile_time), np.array(upload_time)
+
+benchmarks = {
+    'csv': lambda core, n, k, seed: bench_flat_wfm(core, n, k, True, seed),
+    'placeholder': lambda core, n, k, seed: bench_flat_wfm(core, n, k, False, seed),
+    'waveforms': bench_waveforms,
+    'ct': bench_command_table,
+}
+
+def implausible(results, latency):
+    """Benchmarks with times below what the mock latency model allows
+
+    Every compilation takes at least `compile_base`, and every upload at
+    least one round trip; shorter times mean that the operation finished
+    while HDAWG_Core was not polling, and was not measured.
+
+    Returns
+    -------
+    list
+        Names of the benchmarks with implausible times
+    """
+    return [name for name, (compile_time, upload_time) in results.items()
+            if np.any(compile_time < latency.compile_base) or np.any(upload_time < latency.round_trip)]
+
+def run_benchmarks(daq, device, names, n, k, awg_index=0, out_dir='.', seed=None):
+    """Run some benchmarks and save their results
+
+    The ELF cache is disabled and the compilation forced, so that every
+    iteration is compiled.
+
+    Parameters
+    ----------
+    daq: ziDAQServer or Mock_DAQ_Server
+        Connection to the data server
+    device: str
+        Serial of the HDAWG
+    names: list
+        Names of the benchmarks, keys of `benchmarks`
+    n, k: int
+        Number of sizes and of iterations per size
+    """
+    core = HDAWG_Core(daq, device, awg_index, elf_cache=None, timer=Phase_Timer())
+    os.makedirs(out_dir, exist_ok=True)
+    np.savetxt(os.path.join(out_dir, 'params.txt'), [n, k], fmt='%d')
+    results = {}
+    for name in names:
+        compile_time, upload_time = benchmarks[name](core, n, k, seed)
+        np.savetxt(os.path.join(out_dir, f'compile_time_{name:s}.txt'), compile_time)
+        np.savetxt(os.path.join(out_dir, f'upload_time_{name:s}.txt'), upload_time)
+        results[name] = (compile_time, upload_time)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('benchmarks', nargs='*', help=f"benchmarks to run, among {', '.join(benchmarks)}; all by default")
+    parser.add_argument('-n', type=int, default=6, help='number of sizes, 2^1 ... 2^n')
+    parser.add_argument('-k', type=int, default=5, help='iterations per size')
+    parser.add_argument('--host', help='data server host; without it the mock server is used')
+    parser.add_argument('--device', default='dev8000')
+    parser.add_argument('--awg', type=int, default=0, help='index of the AWG core')
+    parser.add_argument('--out', default='.', help='directory of the result files')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--round-trip', type=float, default=Latency_Model().round_trip,
+                        help='latency of a data server call in the mock, in seconds')
+    parser.add_argument('--bandwidth', type=float, default=Latency_Model().bandwidth,
+                        help='transfer rate of the mock, in bytes/s')
+    args = parser.parse_args()
+    for name in args.benchmarks:
+        if name not in benchmarks:
+            parser.error(f'unknown benchmark {name}')
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.host is None:
+            latency = Latency_Model(round_trip=args.round_trip, bandwidth=args.bandwidth)
+            daq = Mock_DAQ_Server(args.device, latency, directory=directory)
+        else:
+            import zhinst.ziPython as zi
+            daq = zi.ziDAQServer(args.host, 8004, 6)
+        results = run_benchmarks(daq, args.device, args.benchmarks or list(benchmarks), args.n, args.k, args.awg, args.out, args.seed)
+
+    for name, (compile_time, upload_time) in results.items():
+        print(f'{name:12s} compile {compile_time.mean()*1e3:8.2f} ms   upload {upload_time.mean()*1e3:8.2f} ms')
+    if args.host is None:
+        for name in implausible(results, latency):
+            print(f'warning: {name:s} has times below the latency model, they are not measured correctly')
+
+if __name__ == '__main__':
+    main()
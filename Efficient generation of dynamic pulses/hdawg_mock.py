@@ -0,0 +1,223 @@
+# Copyright (C) 2026 Zurich Instruments
+#
+# This software may be modified and distributed under the terms
+# of the MIT license. See the LICENSE file for details.
+
+import numpy as np
+import threading, time, os, re, hashlib
+
+class Latency_Model():
+    """Latency of the data server and of the AWG compiler
+
+    All the times are in seconds. Every call to the data server costs one
+    `round_trip`, plus the transfer of the data at `bandwidth` (bytes/s).
+    A compilation costs `compile_base`, plus `compile_per_char` for every
+    character of the source and `compile_per_sample` for every sample of the
+    waveforms read from CSV files.
+    """
+
+    def __init__(self, round_trip=0.5e-3, bandwidth=50e6, compile_base=10e-3,
+                 compile_per_char=0.2e-6, compile_per_sample=0.5e-6, run_time=1e-3):
+        self.round_trip = round_trip
+        self.bandwidth = bandwidth
+        self.compile_base = compile_base
+        self.compile_per_char = compile_per_char
+        self.compile_per_sample = compile_per_sample
+        self.run_time = run_time
+
+    def transfer(self, nbytes=0):
+        time.sleep(self.round_trip + nbytes / self.bandwidth)
+
+    def compile(self, n_chars, n_samples):
+        time.sleep(self.compile_base + n_chars * self.compile_per_char + n_samples * self.compile_per_sample)
+
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return 8
+
+class Mock_AWG_Module():
+    """Stand-in for the awgModule of ziDAQServer
+
+    Compiles in a background thread, taking the time given by the latency
+    model, and writes a dummy ELF file where the real compiler would.
+    """
+
+    def __init__(self, daq):
+        self.daq = daq
+        self.params = {
+            'device': '',
+            'index': 0,
+            'directory': os.path.join(daq.directory, 'Zurich Instruments', 'LabOne', 'WebServer'),
+            'elf/file': 'awg_default.elf',
+            'elf/status': 0,
+            'progress': 0.0,
+            'compiler/upload': 1,
+            'compiler/status': -1,
+            'compiler/statusstring': '',
+            'compiler/sourcestring': '',
+        }
+
+    def execute(self):
+        pass
+
+    def set(self, name, value):
+        self.params[name] = value
+        if name == 'compiler/sourcestring' and value:
+            self.params['compiler/status'] = -1
+            self.params['progress'] = 0.0
+            threading.Thread(target=self._compile, args=(value,), daemon=True).start()
+
+    def _compile(self, source):
+        # samples of the waveforms read from CSV files
+        n_samples = 0
+        waves_dir = os.path.join(self.params['directory'], 'awg', 'waves')
+        for name in re.findall(r'wave\s+\w+\s*=\s*"(\w+)"', source):
+            with open(os.path.join(waves_dir, name + '.csv')) as f:
+                n_samples += sum(1 for _ in f)
+        self.daq.latency.compile(len(source), n_samples)
+
+        # dummy ELF, of the size of the program and of the embedded samples
+        elf = hashlib.sha256(source.encode()).digest() * ((len(source) + 4 * n_samples) // 32 + 1)
+        elf_dir = os.path.join(self.params['directory'], 'awg', 'elf')
+        os.makedirs(elf_dir, exist_ok=True)
+        device, index = self.params['device'].lower(), int(self.params['index'])
+        with open(os.path.join(elf_dir, f"{device:s}_{index:d}_{self.params['elf/file']:s}"), 'wb') as f:
+            f.write(elf)
+        self.daq.compilations += 1
+
+        self.params['compiler/sourcestring'] = ''
+        self.params['compiler/status'] = 0
+        if self.params['compiler/upload']:
+            self.daq.set(f'/{device:s}/awgs/{index:d}/elf/data', np.frombuffer(elf, dtype=np.uint32))
+            self.params['progress'] = 1.0
+
+    def getInt(self, name):
+        return int(self.params[name])
+
+    def getDouble(self, name):
+        return float(self.params[name])
+
+    def getString(self, name):
+        return str(self.params[name])
+
+    def get(self, name):
+        return self.params[name]
+
+class Mock_DAQ_Server():
+    """Stand-in for ziDAQServer with an HDAWG, to benchmark HDAWG_Core
+    without instrument
+
+    Nodes are kept in a dictionary; every call waits for the latency of the
+    model. Enabling an AWG core runs it for `latency.run_time`.
+    """
+
+    def __init__(self, device='dev8000', latency=None, directory=None):
+        """
+        Parameters
+        ----------
+        device: str
+            The serial of the simulated HDAWG
+        latency: Latency_Model
+            Latency of the calls, defaults to Latency_Model()
+        directory: str
+            Base directory of the awgModule files, the current one by default
+        """
+        self.latency = latency or Latency_Model()
+        self.directory = directory or os.getcwd()
+        self.device = device.lower()
+        self.compilations = 0
+        self.calls = 0
+        self.bytes = 0
+        self.nodes = {
+            '/zi/about/revision': 230644000,
+            f'/{self.device}/system/fwrevision': 70000,
+            f'/{self.device}/features/devtype': 'HDAWG8',
+            f'/{self.device}/features/options': 'MF\nME\nPC',
+            f'/{self.device}/system/awg/channelgrouping': 0,
+            f'/{self.device}/system/clocks/sampleclock/freq': 2.4e9,
+        }
+        self._subscribed = set()
+        self._events = []
+        self._lock = threading.Lock()
+
+    def _transfer(self, nbytes=0):
+        self.calls += 1
+        self.bytes += nbytes
+        self.latency.transfer(nbytes)
+
+    def _write(self, path, value):
+        path = path.lower()
+        with self._lock:
+            self.nodes[path] = value
+            if path in self._subscribed:
+                self._events.append((path, value))
+        if path.endswith('/elf/data'):
+            self._write(path[:-len('elf/data')] + 'ready', 1)
+        elif re.fullmatch(r'/\w+/awgs/\d/enable', path) and value == 1:
+            threading.Timer(self.latency.run_time, self._write, (path, 0)).start()
+
+    def connectDevice(self, device, interface):
+        self._transfer()
+
+    def awgModule(self):
+        return Mock_AWG_Module(self)
+
+    def set(self, path, value=None):
+        settings = [(path, value)] if value is not None else path
+        self._transfer(sum(_nbytes(v) for _, v in settings))
+        for p, v in settings:
+            self._write(p, v)
+
+    def setInt(self, path, value):
+        self.set(path, int(value))
+
+    def setDouble(self, path, value):
+        self.set(path, float(value))
+
+    def setString(self, path, value):
+        # only the channel grouping is set as string
+        self.set(path, 0 if value == 'groups_of_2' else value)
+
+    def setVector(self, path, value):
+        self.set(path, value)
+
+    def syncSetInt(self, path, value):
+        self.set(path, int(value))
+        return int(value)
+
+    def asyncSetInt(self, path, value):
+        self._write(path, int(value))
+
+    def getInt(self, path):
+        self._transfer()
+        return int(self.nodes.get(path.lower(), 0))
+
+    def getDouble(self, path):
+        self._transfer()
+        return float(self.nodes.get(path.lower(), 0.0))
+
+    def getString(self, path):
+        self._transfer()
+        return str(self.nodes.get(path.lower(), ''))
+
+    def sync(self):
+        self._transfer()
+
+    def subscribe(self, path):
+        self._subscribed.add(path.lower())
+
+    def unsubscribe(self, path):
+        self._subscribed.discard(path.lower())
+
+    def poll(self, recording_time, timeout, flags=0, flat=True):
+        time.sleep(recording_time)
+        self._transfer()
+        with self._lock:
+            events, self._events = self._events, []
+        data = {}
+        for path, value in events:
+            data.setdefault(path, {'value': []})['value'].append(value)
+        return data
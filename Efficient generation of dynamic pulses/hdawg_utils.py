@@ -3,18 +3,404 @@
 # This software may be modified and distributed under the terms
 # of the MIT license. See the LICENSE file for details.
 
-import zhinst.utils
 import zhinst.ziPython as zi
-import json, time
+import numpy as np
+import json, time, os, hashlib, csv, contextlib, threading, weakref
+from concurrent.futures import ThreadPoolExecutor, Future
 from packaging import version
 from types import SimpleNamespace
 
+def _wait_for(condition, timeout=None, min_interval=0.0005, max_interval=0.001):
+    """Poll `condition` until it returns True
+
+    The polling interval starts at `min_interval` and doubles up to
+    `max_interval`, so that the end of an operation is detected within
+    about a millisecond, as with the tight polling loops of the notebooks.
+    Returns False if `timeout` (in seconds) expired first.
+    """
+    interval = min_interval
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not condition():
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+        time.sleep(interval)
+        interval = min(2 * interval, max_interval)
+    return True
+
+def _shutdown_executors(*executors, wait=False):
+    for executor in executors:
+        executor.shutdown(wait=wait)
+
+def convert_waveforms(waves):
+    """Convert waveforms to the raw format of the waveform memory
+
+    Equivalent to calling `zhinst.utils.convert_awg_waveform` on every
+    entry, but all waveforms of the same length are converted together.
+
+    Parameters
+    ----------
+    waves: list
+        List of the waveforms, each a tuple (wave1, wave2) or
+        (wave1, wave2, markers)
+
+    Returns
+    -------
+    list
+        The raw waveforms, as arrays of uint16
+    """
+    def to_uint16(data, k):
+        # the waves are scaled to full range, the markers are bits
+        if k < 2:
+            return ((2**15 - 1) * data).astype(np.int16).view(np.uint16)
+        return data.astype(np.uint16)
+
+    raw = [None] * len(waves)
+    groups = {}
+    for i, wave in enumerate(waves):
+        shape = (len(wave), len(wave[0]))
+        groups.setdefault(shape, []).append(i)
+
+    for (n_parts, length), indices in groups.items():
+        # stack as (waves, samples, parts), interleaving the parts of each sample
+        parts = [np.array([waves[i][k] for i in indices]) for k in range(n_parts)]
+        block = np.stack([to_uint16(part, k) for k, part in enumerate(parts)], axis=-1).reshape(len(indices), -1)
+        for i, row in zip(indices, block):
+            raw[i] = row
+    return raw
+
+class ELF_Cache():
+    """Persistent cache of compiled sequencer programs (ELF files)
+
+    The ELF files are stored in a directory, named after a hash of everything
+    the compiler output depends on. The least recently used files are removed
+    when the total size of the cache exceeds `max_size`.
+    Programs reading waveforms from CSV files are not supported, since the
+    content of the files is not part of the key.
+    """
+
+    def __init__(self, directory, max_size=256*2**20):
+        """
+        Parameters
+        ----------
+        directory: str
+            The directory where the ELF files are stored
+        max_size: int
+            Maximum total size of the cached files, in bytes
+        """
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(source, *context):
+        """Hash of the sequencer source and of its compilation context
+        (device type, options, compiler version, ...)"""
+        h = hashlib.sha256()
+        for item in (source,) + context:
+            h.update(str(item).encode())
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.elf')
+
+    def get(self, key):
+        """Return the cached ELF, or None if it is not in the cache"""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                elf = f.read()
+        except FileNotFoundError:
+            return None
+        # mark as recently used
+        os.utime(path)
+        return elf
+
+    def put(self, key, elf):
+        """Store an ELF in the cache and evict the least recently used ones"""
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(elf)
+        os.replace(tmp, path)
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.elf'):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+class CommandTableEntry():
+    """View on one entry of a CommandTable
+
+    Reading and writing the attributes reads and writes the columns of the
+    table; an unset value reads as None.
+    """
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    @property
+    def index(self):
+        return self._index
+
+    def __repr__(self):
+        return f"CommandTableEntry({self._table._entry_dict(self._index)})"
+
+def _ct_value(column):
+    def fget(self):
+        value = self._table._columns[column][self._index]
+        unset = CommandTable._unset[column]
+        if unset is not False and (value == unset or np.isnan(value)):
+            return None
+        return value.item()
+    def fset(self, value):
+        self._table.set(self._index, **{column: value})
+    return property(fget, fset)
+
+for _column in ('waveform', 'length', 'playZero', 'phase0', 'phase0_increment', 'phase1', 'phase1_increment',
+                'amplitude0', 'amplitude0_increment', 'amplitude1', 'amplitude1_increment'):
+    setattr(CommandTableEntry, _column, _ct_value(_column))
+del _column
+
+class CommandTable():
+    """Command table stored as NumPy columns
+
+    The row of each column is the index of the entry. The serialized JSON
+    is cached and only rebuilt after a change, so that uploading the same
+    table again costs a string comparison.
+
+    The fields of the waveform of an entry are the columns `waveform` (its
+    index), `length` and `playZero`.
+    """
+    max_entries = 1024
+    max_waveforms = 16000
+
+    # value marking an unset field in each column
+    _unset = {
+        'waveform': -1, 'length': -1, 'playZero': False,
+        'phase0': np.nan, 'phase0_increment': False,
+        'phase1': np.nan, 'phase1_increment': False,
+        'amplitude0': np.nan, 'amplitude0_increment': False,
+        'amplitude1': np.nan, 'amplitude1_increment': False,
+    }
+
+    def __init__(self, entries=None):
+        """
+        Parameters
+        ----------
+        entries: list
+            Optional list of entries as dictionaries, in the format
+            accepted by `HDAWG_Core.load_ct`
+        """
+        self._used = np.zeros(self.max_entries, dtype=bool)
+        self._columns = {}
+        for column, unset in self._unset.items():
+            dtype = np.int32 if column in ('waveform', 'length') else type(unset)
+            self._columns[column] = np.full(self.max_entries, unset, dtype=dtype)
+        self._json = None
+
+        for entry in entries or []:
+            fields = {}
+            for key, value in entry.items():
+                if key == 'waveform':
+                    for field, field_value in value.items():
+                        if field not in self._waveform_fields:
+                            raise ValueError(f"Unsupported command table waveform field {field}")
+                        fields[self._waveform_fields[field]] = field_value
+                elif key != 'index':
+                    fields[key] = value['value']
+                    fields[f'{key}_increment'] = value.get('increment', False)
+            self.set(entry['index'], **fields)
+
+    # column of each field of the waveform of an entry
+    _waveform_fields = {'index': 'waveform', 'length': 'length', 'playZero': 'playZero'}
+
+    def __getitem__(self, index):
+        return CommandTableEntry(self, index)
+
+    def __len__(self):
+        return int(self._used.sum())
+
+    def set(self, index, **columns):
+        """Set fields of one or many entries
+
+        Parameters
+        ----------
+        index: int or array
+            Index of the entries
+        **columns:
+            Values of the fields, scalars or arrays of the same length as
+            `index`, e.g. `waveform=1, phase0=np.linspace(0, 360, 512)`
+        """
+        index = np.asarray(index)
+        for column, value in columns.items():
+            if column not in self._columns:
+                raise Exception(f"Unknown command table field {column}")
+            self._columns[column][index] = self._unset[column] if value is None else value
+        self._used[index] = True
+        self._json = None
+
+    def clear(self, index=None):
+        """Remove one or many entries, or all of them if `index` is None"""
+        if index is None:
+            index = slice(None)
+        self._used[index] = False
+        for column, unset in self._unset.items():
+            self._columns[column][index] = unset
+        self._json = None
+
+    def validate(self):
+        """Check all the entries at once, raise an Exception if any is invalid"""
+        used = self._used
+        checks = [
+            ('waveform index', (self._columns['waveform'] < -1) | (self._columns['waveform'] >= self.max_waveforms)),
+            ('waveform length', (self._columns['length'] < -1) | (self._columns['playZero'] & (self._columns['length'] < 0))),
+            ('amplitude', (np.abs(self._columns['amplitude0']) > 1) | (np.abs(self._columns['amplitude1']) > 1)),
+            ('phase', np.isinf(self._columns['phase0']) | np.isinf(self._columns['phase1'])),
+        ]
+        for name, bad in checks:
+            bad = np.flatnonzero(bad & used)
+            if bad.size:
+                raise Exception(f"Invalid {name} in command table entries {bad.tolist()}")
+
+    def _entry_dict(self, i):
+        entry = {'index': int(i)}
+        waveform = {}
+        if self._columns['waveform'][i] >= 0:
+            waveform['index'] = int(self._columns['waveform'][i])
+        if self._columns['length'][i] >= 0:
+            waveform['length'] = int(self._columns['length'][i])
+        if self._columns['playZero'][i]:
+            waveform['playZero'] = True
+        if waveform:
+            entry['waveform'] = waveform
+        for field in ('phase0', 'phase1', 'amplitude0', 'amplitude1'):
+            value = self._columns[field][i]
+            if not np.isnan(value):
+                entry[field] = {'value': float(value), 'increment': bool(self._columns[f'{field}_increment'][i])}
+        return entry
+
+    def to_list(self):
+        """The entries as a list of dictionaries"""
+        return [self._entry_dict(i) for i in np.flatnonzero(self._used)]
+
+    def to_json(self):
+        """The command table serialized as JSON, validated and cached"""
+        if self._json is None:
+            self.validate()
+            self._json = json.dumps({'header': {'version': '0.2'}, 'table': self.to_list()})
+        return self._json
+
+class _Timed_Phase():
+    __slots__ = ('timer', 'name', 'nbytes', 'start')
+
+    def __init__(self, timer, name, nbytes):
+        self.timer = timer
+        self.name = name
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.add(self.name, time.perf_counter() - self.start, self.nbytes)
+
+# shared context of the phases when timing is off
+_NO_TIMING = contextlib.nullcontext()
+
+class Phase_Timer():
+    """Record the duration and transferred bytes of each phase of the
+    configuration of the AWG
+
+    Assign an instance to `HDAWG_Core.timer` (or pass it to the constructor)
+    to record the phases "source", "compile", "elf_transfer", "wave_transfer",
+    "ct_transfer" and "run"; with `timer = None` nothing is recorded.
+    """
+
+    def __init__(self):
+        self.records = {}
+
+    def phase(self, name, nbytes=0):
+        """Context measuring one phase; set `nbytes` on it to record the bytes"""
+        return _Timed_Phase(self, name, nbytes)
+
+    def add(self, name, duration, nbytes=0):
+        self.records.setdefault(name, []).append((duration, nbytes))
+
+    def reset(self):
+        self.records.clear()
+
+    def durations(self, name):
+        """All the durations of a phase in seconds, as array"""
+        return np.array([duration for duration, _ in self.records.get(name, [])])
+
+    def histogram(self, name, bins=20):
+        """Histogram of the durations of a phase, as returned by np.histogram"""
+        return np.histogram(self.durations(name), bins=bins)
+
+    def summary(self):
+        """Count, total, mean, min and max duration and total bytes of each phase"""
+        summary = {}
+        for name, records in self.records.items():
+            durations = np.array([duration for duration, _ in records])
+            summary[name] = {
+                'count': len(records),
+                'total': float(durations.sum()),
+                'mean': float(durations.mean()),
+                'min': float(durations.min()),
+                'max': float(durations.max()),
+                'bytes': int(sum(nbytes for _, nbytes in records)),
+            }
+        return summary
+
+    def to_csv(self, path):
+        """Write all the records as CSV, one line per phase execution"""
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['phase', 'duration', 'bytes'])
+            for name, records in self.records.items():
+                writer.writerows((name, duration, nbytes) for duration, nbytes in records)
+
+    def to_json(self, path=None):
+        """The records and their summary as JSON; written to `path` if given"""
+        data = json.dumps({
+            'summary': self.summary(),
+            'records': {name: [{'duration': d, 'bytes': b} for d, b in records]
+                        for name, records in self.records.items()},
+        })
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(data)
+        return data
+
 class HDAWG_Core():
     ziPython_min = version.parse("21.8.20085")
     labone_min = version.parse("21.8.20085")
     hdawg_fw_min = version.parse("67742")
 
-    def __init__(self, daq, device, awg_index):
+    # Devices already set up in this session, by (connection, serial): probed
+    # versions and features, and for each AWG core its module and what is
+    # loaded on it, shared by all the instances. Entries older than
+    # session_ttl seconds are probed again.
+    session_ttl = 3600.0
+    _sessions = {}
+
+    def __init__(self, daq, device, awg_index, elf_cache=None, setup_device=True, timer=None):
         """Configure the device. Mode of 2 channels grouped
         
         Parameters
@@ -25,42 +411,107 @@ class HDAWG_Core():
             The serial of the HDAWG
         awg_index: int
             The index of the AWG core
+        elf_cache: ELF_Cache
+            Cache of compiled programs; if given, programs that were
+            compiled before are uploaded without compiling them again
+        setup_device: bool
+            Connect the device, check the versions and set the channel
+            grouping. Only to be skipped if this was done already,
+            e.g. by HDAWG for another core. Also skipped if it was done
+            for this device and connection less than session_ttl ago
+        timer: Phase_Timer
+            Records the duration of each phase of the configuration;
+            if None (default), nothing is recorded
         """
 
         self.daq = daq
         self.device = device
         self.awg_index = awg_index
-
-        self.daq.connectDevice(device, '1gbe')
+        self.elf_cache = elf_cache
+        self.timer = timer
 
         self.reset_parameters()
 
-        #Check versions
-        self._check_versions()
+        key = (id(daq), device.lower())
+        session = HDAWG_Core._sessions.get(key)
+        fresh = session is not None and time.monotonic() - session.time < HDAWG_Core.session_ttl
 
-        # Configure 2x4 mode
-        self.daq.setString(f'/{self.device}/system/awg/channelgrouping', 'groups_of_2')
+        if setup_device and not fresh:
+            self.daq.connectDevice(device, '1gbe')
 
-        # Setup AWG module
-        self.awg_module = daq.awgModule()
-        self.awg_module.set('device', device)
-        self.awg_module.set('index', awg_index)
-        # Execute commands
-        self.awg_module.execute()
+            #Check versions
+            self._check_versions()
+
+            # Configure 2x4 mode, if not already
+            if self.daq.getInt(f'/{self.device}/system/awg/channelgrouping') != 0:
+                self.daq.setString(f'/{self.device}/system/awg/channelgrouping', 'groups_of_2')
+
+            # the connection is kept in the entry, so that its id stays unique
+            session = SimpleNamespace(daq=daq, time=time.monotonic(),
+                                      labone_revision=self.labone_revision, hdawg_fw=self.hdawg_fw,
+                                      features=None,
+                                      cores=session.cores if session is not None else {})
+            HDAWG_Core._sessions[key] = session
+            # the device may have been reconfigured since the AWG modules were
+            # created, what they loaded is not known anymore
+            for state in session.cores.values():
+                state.wave_hashes.clear()
+                state.loaded_source = None
+                state.loaded_ct = None
+        elif session is None:
+            session = SimpleNamespace(daq=daq, time=-np.inf,
+                                      labone_revision=self.daq.getInt('/zi/about/revision'), hdawg_fw=None,
+                                      features=None, cores={})
+            HDAWG_Core._sessions[key] = session
+        self._session = session
+        self.labone_revision = session.labone_revision
+        self.hdawg_fw = session.hdawg_fw
+
+        # Setup AWG module, or reuse the one of this core; what is loaded on
+        # the core is shared with the other instances using it
+        self._state = session.cores.get(awg_index)
+        if self._state is None:
+            awg_module = daq.awgModule()
+            awg_module.set('device', device)
+            awg_module.set('index', awg_index)
+            awg_module.set('elf/file', 'awg_default.elf')
+            # Execute commands
+            awg_module.execute()
+            self._state = SimpleNamespace(awg_module=awg_module,
+                                          # fingerprints of the waveforms in the waveform memory, by index
+                                          wave_hashes={},
+                                          # source of the program loaded on the sequencer, if known
+                                          loaded_source=None,
+                                          # last command table loaded, as JSON
+                                          loaded_ct=None,
+                                          # held while the AWG module compiles or uploads
+                                          lock=threading.Lock())
+            session.cores[awg_index] = self._state
+        self.awg_module = self._state.awg_module
+
+    def _phase(self, name):
+        """Context timing a phase, if a timer is set"""
+        if self.timer is None:
+            return _NO_TIMING
+        return self.timer.phase(name)
 
     def reset_parameters(self):
         #add a space for constants
         self.constants = SimpleNamespace()
         self.registers = SimpleNamespace()
+        #and for waveforms, declared as placeholders and uploaded by config
+        self.waveforms = SimpleNamespace()
 
     #Verify that all the components have the right version
     def _check_versions(self):
         ziPython_ver = version.parse(zi.__version__)
         
         labone_ver_raw = self.daq.getInt('/zi/about/revision')
+        self.labone_revision = labone_ver_raw
         labone_ver = version.parse(f'{labone_ver_raw//10**7}.{labone_ver_raw//10**5%100}.{labone_ver_raw%10**5}')
 
         hdawg_fw_ver = version.parse(str(self.daq.getInt(f'/{self.device:s}/system/fwrevision')))
+        self.hdawg_fw = hdawg_fw_ver
 
         if ziPython_ver < HDAWG_Core.ziPython_min:
             raise Exception(f"The zhinst package needs to be updated to version {HDAWG_Core.ziPython_min.public:s} or above!\n"
@@ -72,7 +523,7 @@ class HDAWG_Core():
             raise Exception(f"The FW on device {self.device:s} needs to be updated!\n"
                             "Please follow the instructions in the User Manual to perform the FW upgrade")
 
-    def config(self, program, ct=None, waves=None):
+    def config(self, program, ct=None, waves=None, force=False):
         """Configure the device
         
         Parameters
@@ -82,57 +533,131 @@ class HDAWG_Core():
         ct: dict
             The Command Table, as dictionary
         waves: list
-            List of the waveforms
+            List of the waveforms; by default the ones in `self.waveforms`
+        force: bool
+            Compile and upload even if the same program is already loaded
         """
         
         ## Configure AWG
+        # the waveforms declared in self.waveforms, if no others are given
+        if waves is None:
+            waves = self._waves_list()
+
         # Stop AWG
         self.daq.setInt(f'/{self.device}/awgs/{self.awg_index}/enable', 0)
 
         # Send sequence
-        self.compile_seqc(program)
-
-        # Run AWG program only once
-        self.daq.setInt(f'/{self.device}/awgs/{self.awg_index}/single', 1)
+        self.compile_seqc(program, force)
 
-        # Enable channel outputs
-        self.daq.setInt(f'/{self.device}/sigouts/{self.awg_index*2}/on', 1)
-        self.daq.setInt(f'/{self.device}/sigouts/{self.awg_index*2+1}/on', 1)
+        # Run AWG program only once and enable channel outputs
+        self.daq.set(self._outputs_cmd())
 
         #send AWG waves
         if waves is not None:
-            for i, wave in enumerate(waves):
-                wave_raw = zhinst.utils.convert_awg_waveform(wave[0],wave[1])
-                self.daq.setVector(f'/{self.device}/awgs/{self.awg_index}/waveform/waves/{i}', wave_raw)
+            self.upload_waves(waves)
 
         #load the command table
         if ct is not None:
             self.load_ct(ct)
 
+    def upload_waves(self, waves):
+        """Upload the waveforms that differ from the ones in the waveform memory
+        
+        The waveforms already uploaded since the last program upload are
+        remembered by a hash of their content; only the changed ones are
+        converted and sent, all together in a single transfer.
+
+        Parameters
+        ----------
+        waves: list
+            List of the waveforms, the index in the list is the waveform index
+        """
+        with self._phase('wave_transfer') as phase:
+            set_cmd, changed = self._waves_cmd(waves)
+            if set_cmd:
+                self.daq.set(set_cmd)
+                self._state.wave_hashes.update(changed)
+            if phase is not None:
+                phase.nbytes = sum(wave_raw.nbytes for _, wave_raw in set_cmd)
+
+    def _outputs_cmd(self):
+        return [
+            (f'/{self.device}/awgs/{self.awg_index}/single', 1),
+            (f'/{self.device}/sigouts/{self.awg_index*2}/on', 1),
+            (f'/{self.device}/sigouts/{self.awg_index*2+1}/on', 1),
+        ]
+
+    def _waves_cmd(self, waves):
+        """Set commands for the changed waveforms, and their new fingerprints"""
+        changed = []
+        for i, wave in enumerate(waves):
+            h = hashlib.blake2b(digest_size=16)
+            for part in wave:
+                part = np.ascontiguousarray(part)
+                h.update(str((part.dtype, part.shape)).encode())
+                h.update(part.tobytes())
+            digest = h.digest()
+            if self._state.wave_hashes.get(i) != digest:
+                changed.append((i, digest))
+
+        waves_raw = convert_waveforms([waves[i] for i, _ in changed])
+        set_cmd = [(f'/{self.device}/awgs/{self.awg_index}/waveform/waves/{i}', wave_raw)
+                   for (i, _), wave_raw in zip(changed, waves_raw)]
+        return set_cmd, changed
+
     def load_ct(self, ct):
         """Load a command table
         
+        The table is only sent if it differs from the one loaded last.
+
         Parameters
         ----------
-        ct: dict
-            The Command Table, as dictonary
+        ct: list or CommandTable
+            The Command Table, as list of entries (dictonaries) or as CommandTable
         """
         
         #Create CT  and send it to the device
+        with self._phase('ct_transfer') as phase:
+            set_cmd, ct_json = self._ct_cmd(ct)
+            if set_cmd:
+                self.daq.setVector(*set_cmd[0])
+                self._state.loaded_ct = ct_json
+                if phase is not None:
+                    phase.nbytes = len(ct_json)
+
+    @staticmethod
+    def _ct_json(ct):
+        """The command table as JSON; `ct` may already be serialized"""
+        if isinstance(ct, str):
+            return ct
+        if isinstance(ct, CommandTable):
+            return ct.to_json()
         ct_all = {'header':{'version':'0.2'}, 'table':ct}
-        node = f"/{self.device:s}/awgs/{self.awg_index}/commandtable/data"
-        self.daq.setVector(node, json.dumps(ct_all))
+        return json.dumps(ct_all)
 
-    def _setUserRegs(self):
-        #if no registers are defined, skip this phase
-        if not bool(self.registers.__dict__):
-            return
+    def _ct_cmd(self, ct):
+        """Set command for the command table if it changed, and its JSON"""
+        ct_json = self._ct_json(ct)
+        if ct_json == self._state.loaded_ct:
+            return [], ct_json
+        node = f"/{self.device:s}/awgs/{self.awg_index}/commandtable/data"
+        return [(node, ct_json)], ct_json
 
+    def _userRegs_cmd(self):
         set_cmd = []
         for i,value in enumerate(self.registers.__dict__.values()):
             node = f'/{self.device:s}/awgs/{self.awg_index:d}/userregs/{i:d}'
             set_cmd.append((node, value))
-        
+        return set_cmd
+
+    def _setUserRegs(self, set_cmd=None):
+        if set_cmd is None:
+            set_cmd = self._userRegs_cmd()
+
+        #if no registers are defined, skip this phase
+        if not set_cmd:
+            return
+
         self.daq.set(set_cmd)
 
     def setHold(self, hold):
@@ -150,12 +675,93 @@ class HDAWG_Core():
         self.daq.set(f'/{self.device:s}/awgs/{self.awg_index}/outputs/1/modulation/mode', mode)
 
     def run(self, block=True):
-        self._setUserRegs()
-        node = f'/{self.device:s}/awgs/{self.awg_index}/enable'
-        self.daq.syncSetInt(node, 1)
-        if block:
-            while(self.daq.getInt(node) == 1):
-                time.sleep(0.005)
+        self._run(self._userRegs_cmd(), block)
+
+    def _run(self, set_cmd, block=True):
+        with self._phase('run'):
+            self._setUserRegs(set_cmd)
+            node = f'/{self.device:s}/awgs/{self.awg_index}/enable'
+            self.daq.syncSetInt(node, 1)
+            if block:
+                _wait_for(lambda: self.daq.getInt(node) != 1)
+
+    def sweep(self, values, chunk_size=None, timeout=10.0):
+        """Run the loaded program once per sweep point, changing only user registers
+        
+        The program is not compiled again: each point is a single batched
+        set of the registers and of the enable node, and the end of the run
+        is detected from the subscribed enable node instead of polling it.
+        This is a generator; it yields the timing of each chunk of points
+        as soon as the chunk is done.
+
+        Parameters
+        ----------
+        values: dict
+            Values of the registers for every point, as {name: array}.
+            All the arrays must have the same length; registers not in
+            the dictionary keep the value in `self.registers`
+        chunk_size: int
+            Number of points per chunk, all points in one chunk by default.
+            Nothing is run if there are no points
+        timeout: float
+            Maximum duration of a single point, in seconds
+
+        Yields
+        ------
+        SimpleNamespace
+            `points`: the range of points of the chunk,
+            `durations`: the duration of each point in seconds
+        """
+        names = list(self.registers.__dict__.keys())
+        unknown = set(values) - set(names)
+        if unknown:
+            raise Exception(f"Unknown registers {sorted(unknown)}, the program needs to declare them "
+                            "in self.registers before compilation")
+
+        n_points = len(next(iter(values.values()))) if values else 0
+        if any(len(v) != n_points for v in values.values()):
+            raise Exception("All registers need the same number of sweep points")
+        if n_points == 0:
+            return
+        if chunk_size is None:
+            chunk_size = n_points
+        elif chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, not {chunk_size}")
+
+        enable = f'/{self.device:s}/awgs/{self.awg_index}/enable'
+        nodes = [f'/{self.device:s}/awgs/{self.awg_index:d}/userregs/{i:d}' for i in range(len(names))]
+        columns = [values[name] if name in values else [self.registers.__dict__[name]] * n_points
+                   for name in names]
+
+        self.daq.subscribe(enable)
+        try:
+            self.daq.sync()
+            self.daq.poll(0.001, 10, 0, True)
+            for start in range(0, n_points, chunk_size):
+                points = range(start, min(start + chunk_size, n_points))
+                durations = np.empty(len(points))
+                for k, point in enumerate(points):
+                    set_cmd = [(node, col[point]) for node, col in zip(nodes, columns)]
+                    t0 = time.perf_counter()
+                    self.daq.set(set_cmd + [(enable, 1)])
+                    self._wait_stopped(enable, timeout)
+                    durations[k] = time.perf_counter() - t0
+                yield SimpleNamespace(points=points, durations=durations)
+        finally:
+            self.daq.unsubscribe(enable)
+
+    def _wait_stopped(self, enable, timeout):
+        """Wait for the subscribed enable node to go from 1 back to 0"""
+        started = False
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            data = self.daq.poll(0.001, 10, 0, True)
+            for value in data.get(enable.lower(), {}).get('value', []):
+                if value == 1:
+                    started = True
+                elif started:
+                    return
+        raise Exception(f"The AWG did not finish within {timeout} s")
 
     def _const2seqc(self):
         """Transform the constants into
@@ -166,13 +772,10 @@ class HDAWG_Core():
         if not bool(self.constants.__dict__):
             return ""
 
-        seqc = "//Constants definition\n"
-            
-        for name, value in self.constants.__dict__.items():
-            seqc += f"const {name:s} = {value};\n"
-
-        seqc += '\n'
-        return seqc
+        lines = ["//Constants definition\n"]
+        lines += [f"const {name:s} = {value};\n" for name, value in self.constants.__dict__.items()]
+        lines.append('\n')
+        return "".join(lines)
 
     def _regs2seqc(self):
         """Transform the registers into
@@ -183,32 +786,110 @@ class HDAWG_Core():
         if not bool(self.registers.__dict__):
             return ""
         
-        seqc = "//User registers\n"
-            
-        for i,name in enumerate(self.registers.__dict__.keys()):
-            seqc += f"var {name:s} = getUserReg({i:d});\n"
+        lines = ["//User registers\n"]
+        lines += [f"var {name:s} = getUserReg({i:d});\n" for i, name in enumerate(self.registers.__dict__.keys())]
+        lines.append('\n')
+        return "".join(lines)
+
+    @staticmethod
+    def _wave_tuple(wave):
+        """A waveform as tuple (wave1,), (wave1, wave2) or (wave1, wave2, markers)"""
+        if isinstance(wave, np.ndarray) and wave.ndim == 1:
+            return (wave,)
+        return tuple(np.asarray(part) for part in wave)
+
+    def _waves_list(self):
+        """The waveforms in `self.waveforms` as list, in the order of their index"""
+        if not bool(self.waveforms.__dict__):
+            return None
+        return [self._wave_tuple(wave) for wave in self.waveforms.__dict__.values()]
+
+    def _waves2seqc(self):
+        """Transform the waveforms into
+        valid seqc code
+        
+        Each waveform is declared as placeholder, with the length and
+        markers of the arrays, and assigned to its index in `self.waveforms`.
+        A single array is played on the first output of the core as `name`;
+        a tuple (wave1, wave2) or (wave1, wave2, markers) on both outputs as
+        `name_1` and `name_2`. Bits 0-1 of the markers belong to the first
+        output, bits 2-3 to the second one.
+        """
+
+        #if no waveforms are defined, return an empty string
+        if not bool(self.waveforms.__dict__):
+            return ""
 
-        seqc += '\n'
-        return seqc
+        lines = ["//Waveforms\n"]
 
-    def compile_seqc(self, program):
+        for i, (name, wave) in enumerate(self.waveforms.__dict__.items()):
+            wave = self._wave_tuple(wave)
+            length = len(wave[0])
+            if length < 32 or length % 16 != 0:
+                raise Exception(f"The length of waveform {name:s} must be a multiple of 16 and at least 32 samples")
+            if any(len(part) != length for part in wave):
+                raise Exception(f"All the parts of waveform {name:s} must have the same length")
+            markers = wave[2].astype(np.uint16) if len(wave) == 3 else np.zeros(1, dtype=np.uint16)
+            marker_bits = np.bitwise_or.reduce(markers)
+            if len(wave) == 1:
+                lines.append(f"wave {name:s} = placeholder({length:d});\n")
+                lines.append(f"assignWaveIndex(1, {name:s}, {i:d});\n")
+            else:
+                for channel in range(2):
+                    bits = marker_bits >> (2 * channel)
+                    marker1 = 'true' if bits & 1 else 'false'
+                    marker2 = 'true' if bits & 2 else 'false'
+                    lines.append(f"wave {name:s}_{channel+1:d} = placeholder({length:d}, {marker1:s}, {marker2:s});\n")
+                lines.append(f"assignWaveIndex(1, {name:s}_1, 2, {name:s}_2, {i:d});\n")
+
+        lines.append('\n')
+        return "".join(lines)
+
+    def compile_seqc(self, program, force=False):
         """Compile and send a sequence to the device
         
         Parameters
         ----------
         program: str
             The seqc program
+        force: bool
+            Compile and upload even if the same program is already loaded;
+            needed if the program reads waveforms from CSV files that changed
         """
 
-        #Add constants definitions
+        with self._phase('source'):
+            program = self._source(program)
+
+        # Nothing to do if the program is already on the device. Values of
+        # the registers are not part of the source, they are set in `run`
+        if not force and program == self._state.loaded_source:
+            return
+
+        # A new program resets the waveform memory and the command table
+        self._forget_loaded()
+
+        # Compile, or reuse a previously compiled program, and upload it
+        # directly, so that the transfer is timed on its own
+        self._upload_elf(self._compile_elf(program))
+        self._state.loaded_source = program
+
+    def _source(self, program):
+        """Add the constants, registers and waveforms definitions to a program"""
         constants = self._const2seqc()
         registers = self._regs2seqc()
-        program = constants + registers + program
+        waveforms = self._waves2seqc()
+        return constants + registers + waveforms + program
 
-        # Compile program
-        self.awg_module.set('compiler/sourcestring', program)
-        while self.awg_module.getInt('compiler/status') == -1:
-            time.sleep(0.1)
+    def _compile(self, program):
+        """Compile a complete program with the awgModule"""
+        with self._phase('compile'):
+            self.awg_module.set('compiler/sourcestring', program)
+            # after a successful compilation, the source string is cleared once the
+            # compiler is done with it; before that the status may still be 0 from
+            # the previous program
+            _wait_for(lambda: self.awg_module.getInt('compiler/status') in (1, 2)
+                      or (self.awg_module.getInt('compiler/status') == 0
+                          and self.awg_module.getString('compiler/sourcestring') == ''))
         if self.awg_module.getInt('compiler/status') == 1:
             msg = "Failed to compile program. Error message:\n"
             msg += self.awg_module.getString("compiler/statusstring")
@@ -218,8 +899,289 @@ class HDAWG_Core():
             msg += self.awg_module.getString("compiler/statusstring")
             raise Warning(msg)
 
-        # Upload program
-        while (self.awg_module.getDouble('progress') < 1.0) and (self.awg_module.getInt('elf/status') != 1):
-            time.sleep(0.5)
-        if self.awg_module.getInt('elf/status') == 1:
+    def _compile_elf(self, program):
+        """Compile a complete program without uploading it, return the ELF"""
+        if self.elf_cache is not None:
+            key = self.elf_cache.key(program, *self._compiler_context())
+            elf = self.elf_cache.get(key)
+            if elf is not None:
+                return elf
+
+        # the module is shared with the other instances and threads of this core
+        with self._state.lock:
+            self.awg_module.set('compiler/upload', 0)
+            try:
+                self._compile(program)
+                elf = self._read_elf()
+            finally:
+                self.awg_module.set('compiler/upload', 1)
+
+        if self.elf_cache is not None:
+            self.elf_cache.put(key, elf)
+        return elf
+
+    def _executors(self):
+        # one thread compiles, one talks to the device, so that the next
+        # program can be compiled while the current one is uploaded or running
+        if not hasattr(self, '_compile_executor'):
+            self._compile_executor = ThreadPoolExecutor(max_workers=1)
+            self._device_executor = ThreadPoolExecutor(max_workers=1)
+            # stop the threads if the instance is dropped without close
+            self._finalizer = weakref.finalize(self, _shutdown_executors,
+                                               self._compile_executor, self._device_executor)
+        return self._compile_executor, self._device_executor
+
+    def close(self):
+        """Stop the threads of `compile_async`, `upload_async` and `run_async`
+        
+        Waits for the pending calls to finish. The instance can still be
+        used; new asynchronous calls start new threads.
+        """
+        if hasattr(self, '_compile_executor'):
+            self._finalizer.detach()
+            _shutdown_executors(self._compile_executor, self._device_executor, wait=True)
+            del self._compile_executor, self._device_executor, self._finalizer
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def compile_async(self, program, ct=None):
+        """Compile a sequence in the background, without uploading it
+        
+        The constants, registers and waveforms in `self.waveforms` are taken
+        at the time of the call, as well as the command table.
+
+        Parameters
+        ----------
+        program: str
+            The seqc program
+        ct: list or CommandTable
+            The Command Table to load with the program, if any
+
+        Returns
+        -------
+        Future
+            Resolves to the compiled program, with its waveforms and command
+            table, to pass to `upload_async`
+        """
+        source = self._source(program)
+        waves = self._waves_list()
+        if waves is not None:
+            # copies, the arrays may change before the upload
+            waves = [tuple(np.array(part) for part in wave) for wave in waves]
+        ct_json = None if ct is None else self._ct_json(ct)
+
+        def compile():
+            return SimpleNamespace(elf=self._compile_elf(source), source=source, waves=waves, ct=ct_json)
+        return self._executors()[0].submit(compile)
+
+    def upload_async(self, compiled):
+        """Upload a compiled program in the background
+        
+        Uploads are executed in order, after any pending upload or run. The
+        waveforms and command table of the program are written right after
+        it, since uploading a program clears the waveform memory.
+
+        Parameters
+        ----------
+        compiled: bytes or Future
+            The Future returned by `compile_async`, its result, or a
+            compiled program (ELF) alone
+        """
+        def upload():
+            program = compiled.result() if isinstance(compiled, Future) else compiled
+            if isinstance(program, bytes):
+                program = SimpleNamespace(elf=program, source=None, waves=None, ct=None)
+            self.daq.setInt(f'/{self.device}/awgs/{self.awg_index}/enable', 0)
+            self._upload_elf(program.elf)
+            if program.waves is not None:
+                self.upload_waves(program.waves)
+            if program.ct is not None:
+                self.load_ct(program.ct)
+            self._state.loaded_source = program.source
+        return self._executors()[1].submit(upload)
+
+    def run_async(self):
+        """Run the sequencer in the background
+        
+        The registers are taken at the time of the call. The run is executed
+        after any pending upload or run, and the returned Future resolves when
+        the sequencer has finished.
+        """
+        return self._executors()[1].submit(self._run, self._userRegs_cmd(), True)
+
+    def _compiler_context(self):
+        """Everything besides the source that the compiled program depends on"""
+        # device type and options do not change while connected, read them once
+        if self._session.features is None:
+            self._session.features = (self.daq.getString(f'/{self.device:s}/features/devtype'),
+                                      self.daq.getString(f'/{self.device:s}/features/options'))
+        return self._session.features + (
+            self.daq.getDouble(f'/{self.device:s}/system/clocks/sampleclock/freq'),
+            self.awg_index,
+            self.labone_revision,
+            zi.__version__,
+        )
+
+    def _read_elf(self):
+        """Read the ELF file written by the awgModule compiler"""
+        # the compiler prefixes the file name with device and AWG index
+        elf_file = os.path.join(self.awg_module.getString('directory'), 'awg', 'elf',
+                                f"{self.device.lower():s}_{self.awg_index:d}_{self.awg_module.getString('elf/file'):s}")
+        with open(elf_file, 'rb') as f:
+            return f.read()
+
+    def _upload_elf(self, elf, timeout=10.0):
+        """Upload a compiled program directly to the sequencer
+        
+        Parameters
+        ----------
+        elf: bytes
+            The compiled program
+        timeout: float
+            Maximum time to wait for the sequencer to be ready, in seconds
+        """
+        with self._phase('elf_transfer') as phase:
+            self.daq.set(self._elf_cmd(elf))
+            self._wait_ready(timeout)
+            if phase is not None:
+                phase.nbytes = len(elf)
+
+    def _elf_cmd(self, elf):
+        """Set command to upload a compiled program; forgets what is in memory"""
+        self._forget_loaded()
+        return [(f'/{self.device:s}/awgs/{self.awg_index}/elf/data', np.frombuffer(elf, dtype=np.uint32))]
+
+    def _forget_loaded(self):
+        """Forget the program, waveforms and command table loaded on the core"""
+        self._state.wave_hashes.clear()
+        self._state.loaded_source = None
+        self._state.loaded_ct = None
+
+    def _wait_ready(self, timeout=10.0):
+        node = f'/{self.device:s}/awgs/{self.awg_index}/ready'
+        if not _wait_for(lambda: self.daq.getInt(node) == 1, timeout):
             raise Exception("Failed to upload program.")
+
+
+class HDAWG():
+    """Configure and run several AWG cores of an HDAWG together
+
+    The device is connected and checked once; the programs of all the cores
+    are compiled concurrently, and their waveforms and command tables are
+    sent in a single transfer.
+    """
+
+    def __init__(self, daq, device, awg_indices=range(4), elf_cache=None, timer=None):
+        """
+        Parameters
+        ----------
+        daq : ziDAQServer 
+            The DAQ connection
+        device : str
+            The serial of the HDAWG
+        awg_indices: list
+            The indices of the AWG cores to use
+        elf_cache: ELF_Cache
+            Cache of compiled programs, shared by all the cores
+        timer: Phase_Timer
+            Records the duration of each phase, shared by all the cores
+        """
+        self.daq = daq
+        self.device = device
+        self.timer = timer
+        self.cores = {}
+        for k, awg_index in enumerate(awg_indices):
+            self.cores[awg_index] = HDAWG_Core(daq, device, awg_index, elf_cache, setup_device=(k == 0), timer=timer)
+
+    def __getitem__(self, awg_index):
+        return self.cores[awg_index]
+
+    def _phase(self, name):
+        if self.timer is None:
+            return _NO_TIMING
+        return self.timer.phase(name)
+
+    def config(self, programs, cts=None, waves=None):
+        """Configure several cores at once
+        
+        Parameters
+        ----------
+        programs: dict
+            The seqc program of each core, by AWG index
+        cts: dict
+            The Command Table of each core, by AWG index
+        waves: dict
+            The list of waveforms of each core, by AWG index; by default
+            the ones in `self.waveforms` of the core
+        """
+        cts = cts or {}
+        waves = waves or {}
+        cores = [self.cores[i] for i in programs]
+
+        # Stop the AWGs
+        self.daq.set([(f'/{self.device}/awgs/{core.awg_index}/enable', 0) for core in cores])
+
+        # Compile the programs that are not loaded yet, all in parallel
+        sources = {core: core._source(programs[core.awg_index]) for core in cores}
+        to_compile = [core for core in cores if sources[core] != core._state.loaded_source]
+        if to_compile:
+            with ThreadPoolExecutor(max_workers=len(to_compile)) as pool:
+                elfs = list(pool.map(lambda core: core._compile_elf(sources[core]), to_compile))
+            with self._phase('elf_transfer') as phase:
+                set_cmd = []
+                for core, elf in zip(to_compile, elfs):
+                    set_cmd += core._elf_cmd(elf)
+                self.daq.set(set_cmd)
+                for core in to_compile:
+                    core._wait_ready()
+                    core._state.loaded_source = sources[core]
+                if phase is not None:
+                    phase.nbytes = sum(len(elf) for elf in elfs)
+
+        # Outputs, waveforms and command tables of all the cores together
+        set_cmd = []
+        loaded = []
+        for core in cores:
+            set_cmd += core._outputs_cmd()
+            core_waves = waves.get(core.awg_index, core._waves_list())
+            if core_waves is not None:
+                cmd, changed = core._waves_cmd(core_waves)
+                set_cmd += cmd
+                loaded.append((core._state.wave_hashes.update, changed))
+            if core.awg_index in cts:
+                cmd, ct_json = core._ct_cmd(cts[core.awg_index])
+                set_cmd += cmd
+                if cmd:
+                    loaded.append((lambda ct_json, core=core: setattr(core._state, 'loaded_ct', ct_json), ct_json))
+        with self._phase('wave_ct_transfer') as phase:
+            self.daq.set(set_cmd)
+            if phase is not None:
+                phase.nbytes = sum(value.nbytes if isinstance(value, np.ndarray) else len(str(value))
+                                   for _, value in set_cmd)
+        for update, value in loaded:
+            update(value)
+
+    def run(self, awg_indices=None, block=True):
+        """Start several cores with a single command
+        
+        Parameters
+        ----------
+        awg_indices: list
+            The cores to start, all by default
+        block: bool
+            Wait for all the cores to finish
+        """
+        cores = [self.cores[i] for i in (self.cores if awg_indices is None else awg_indices)]
+        set_cmd = []
+        for core in cores:
+            set_cmd += core._userRegs_cmd()
+        set_cmd += [(f'/{self.device:s}/awgs/{core.awg_index}/enable', 1) for core in cores]
+        self.daq.set(set_cmd)
+        self.daq.sync()
+        if block:
+            nodes = [f'/{self.device:s}/awgs/{core.awg_index}/enable' for core in cores]
+            _wait_for(lambda: all(self.daq.getInt(node) != 1 for node in nodes))
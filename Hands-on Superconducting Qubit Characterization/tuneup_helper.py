@@ -3,8 +3,14 @@
 # Copyright (c) 2022 Zurich Instruments
 ###
 
+import os
+import inspect
+import itertools
+import concurrent.futures as cf
 import numpy as np
 import scipy.optimize as opt
+import scipy.signal as sig
+from scipy import integrate
 import matplotlib.pyplot as plt
 
 
@@ -33,8 +39,115 @@ def func_Fano(x, width, pos, amp, fano = 0, off=.5):
     return off + amp * (fano * width + x - pos)**2 / (width**2 + (x-pos)**2)
 
 
+## initial guesses derived from the data, one function per model
+## y can hold a single trace (n_points) or many traces (n_traces, n_points); x is evenly
+## spaced, common to all traces (n_points) or one axis per trace (n_traces, n_points);
+## the guesses are returned in the parameter order of the model function
+def _linear_lstsq(A, y):
+    # batched linear least squares, A (..., n_points, n_basis), y (..., n_points)
+    AT = np.swapaxes(A, -1, -2)
+    return np.linalg.solve(AT @ A, (AT @ y[..., None]))[..., 0]
+
+def _take(x, i):
+    # x at index i of each trace, for a common x or one x per trace
+    i = np.asarray(i)
+    return np.take_along_axis(np.broadcast_to(x, i.shape + x.shape[-1:]), i[..., None], axis=-1)[..., 0]
+
+def _fft_freq(x, y):
+    # angular frequency of the strongest spectral component, zero-padded FFT
+    n = x.shape[-1]
+    nfft = 8 * n
+    spec = np.abs(np.fft.rfft(y - y.mean(-1, keepdims=True), nfft))
+    k = np.argmax(spec[..., 1:], axis=-1) + 1
+    return 2 * np.pi * k / (nfft * (x[..., -1] - x[..., 0]) / (n - 1))
+
+def _half_width(x, dev):
+    # half width at half maximum of a peak in dev (normalized to 1 at the peak)
+    dx = np.abs(x[..., -1] - x[..., 0]) / (x.shape[-1] - 1)
+    return np.maximum(np.count_nonzero(dev > 0.5, axis=-1), 1) * dx / 2
+
+def guess_osc(x, y):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    freq = _fft_freq(x, y)
+    wx = freq[..., None] * x
+    # with the frequency fixed, amplitude, phase and offset follow from a linear fit
+    a, b, off = np.moveaxis(_linear_lstsq(_stack(np.cos(wx), np.sin(wx), np.ones_like(wx)).swapaxes(-1, -2), y), -1, 0)
+    return np.stack([freq, np.arctan2(-b, a), np.hypot(a, b), off], axis=-1)
+
+def guess_decayOsc(x, y):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    freq = _fft_freq(x, y)
+    # decay rate from a log-linear fit of the envelope of the analytic signal
+    env = np.abs(sig.hilbert(y - y.mean(-1, keepdims=True)))
+    rate = -_linear_lstsq(np.stack([x, np.ones_like(x)], axis=-1), np.log(env + 1e-12 * env.max()))[..., 0]
+    rate = np.maximum(rate, 0)
+    e = np.exp(-rate[..., None] * x)
+    wx = freq[..., None] * x
+    a, b, off = np.moveaxis(_linear_lstsq(_stack(np.cos(wx) * e, np.sin(wx) * e, np.ones_like(wx)).swapaxes(-1, -2), y), -1, 0)
+    return np.stack([freq, np.arctan2(-b, a), rate, np.hypot(a, b), off], axis=-1)
+
+def guess_exp(x, y):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    # y - y[0] = rate*off*(x - x[0]) - rate*integral(y), linear in the running integral,
+    # which avoids having to know the offset before taking the logarithm
+    integral = integrate.cumulative_trapezoid(y, x, initial=0)
+    x0 = np.broadcast_to(x - x[..., :1], y.shape)
+    coef = _linear_lstsq(_stack(np.ones_like(y), x0, integral).swapaxes(-1, -2), y)
+    rate = -coef[..., 2]
+    e = np.exp(-rate[..., None] * x)
+    amp, off = np.moveaxis(_linear_lstsq(_stack(e, np.ones_like(e)).swapaxes(-1, -2), y), -1, 0)
+    return np.stack([rate, off, amp], axis=-1)
+
+def guess_lorentz(x, y):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    off = np.median(y, axis=-1)
+    dev = y - off[..., None]
+    i = np.argmax(np.abs(dev), axis=-1)
+    amp = np.take_along_axis(dev, i[..., None], axis=-1)[..., 0]
+    width = _half_width(x, dev / amp[..., None])
+    return np.stack([width, _take(x, i), amp, off], axis=-1)
+
+def guess_invLorentz(x, y):
+    p = guess_lorentz(x, y)
+    p[..., 2] *= -1
+    return p
+
+def guess_Fano(x, y):
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    # far from resonance the lineshape tends to off + amp, its minimum is off
+    # and its maximum off + amp * (1 + fano**2)
+    far = np.median(y, axis=-1)
+    imin, imax = np.argmin(y, axis=-1), np.argmax(y, axis=-1)
+    ymin, ymax = y.min(axis=-1), y.max(axis=-1)
+    amp = far - ymin
+    q2 = np.clip((ymax - far) / amp, 0, None)
+    xmin, xmax = _take(x, imin), _take(x, imax)
+    fano = np.sign(xmax - xmin) * np.sqrt(q2)
+    width = np.abs(xmax - xmin) * np.abs(fano) / (1 + q2)
+    # for an almost symmetric dip the maximum is lost in the noise, fall back to a Lorentzian
+    symmetric = (q2 < 0.1) | (width == 0)
+    fano = np.where(symmetric, 0, fano)
+    width = np.where(symmetric, _half_width(x, (far[..., None] - y) / amp[..., None]), width)
+    return np.stack([width, xmin + fano * width, amp, fano, ymin], axis=-1)
+
+_guesses = {
+    func_osc: guess_osc,
+    func_decayOsc: guess_decayOsc,
+    func_exp: guess_exp,
+    func_lorentz: guess_lorentz,
+    func_invLorentz: guess_invLorentz,
+    func_Fano: guess_Fano,
+}
+
+
 ## function to fit Rabi oscillations
-def fit_Rabi(x, y, freq, phase, amp=None, off=None, plot=False, bounds=None):
+## guesses that are not given are estimated from the data; if freq or phase are
+## estimated, amp and off are fitted as well
+def fit_Rabi(x, y, freq=None, phase=None, amp=None, off=None, plot=False, bounds=None):
+
+    if freq is None or phase is None:
+        freq, phase, amp, off = [g if g is not None else e
+                                 for g, e in zip([freq, phase, amp, off], guess_osc(x, y))]
 
     if amp is not None:
         if off is not None:
@@ -62,9 +175,13 @@ def fit_Rabi(x, y, freq, phase, amp=None, off=None, plot=False, bounds=None):
 
 
 ## function to fit spectroscopy traces
-def fit_Spec(x, y, width, pos, amp, off=0, plot=False, bounds=None):
-    #if off is None:
-    #    off = np.median(y)
+## guesses that are not given are estimated from the data
+def fit_Spec(x, y, width=None, pos=None, amp=None, off=None, plot=False, bounds=None):
+    if width is None or pos is None or amp is None:
+        width, pos, amp, off = [g if g is not None else e
+                                for g, e in zip([width, pos, amp, off], guess_lorentz(x, y))]
+    elif off is None:
+        off = 0
     if bounds is None:
         popt, pcov = opt.curve_fit(func_lorentz, x, y, p0=[width, pos, amp, off])
     else:
@@ -79,7 +196,13 @@ def fit_Spec(x, y, width, pos, amp, off=0, plot=False, bounds=None):
 
 
 ## function to fit spectroscopy traces with Fano lineshape
-def fit_ResSpec(x, y, width, pos, amp, fano, off=None, plot=False, bounds=None):
+## guesses that are not given are estimated from the data; if any of them is
+## estimated, off is fitted as well
+def fit_ResSpec(x, y, width=None, pos=None, amp=None, fano=None, off=None, plot=False, bounds=None):
+
+    if width is None or pos is None or amp is None or fano is None:
+        width, pos, amp, fano, off = [g if g is not None else e
+                                      for g, e in zip([width, pos, amp, fano, off], guess_Fano(x, y))]
 
     if off is not None:
         if bounds is None:
@@ -99,3 +222,293 @@ def fit_ResSpec(x, y, width, pos, amp, fano, off=None, plot=False, bounds=None):
     
     return popt, pcov
 
+## function to fit Ramsey oscillations
+## guesses that are not given are estimated from the data, all parameters are fitted
+def fit_Ramsey(x, y, freq=None, phase=None, rate=None, amp=None, off=None, plot=False, bounds=None):
+
+    p0 = [g if g is not None else e
+          for g, e in zip([freq, phase, rate, amp, off], guess_decayOsc(x, y))]
+    if bounds is None:
+        popt, pcov = opt.curve_fit(func_decayOsc, x, y, p0=p0)
+    else:
+        popt, pcov = opt.curve_fit(func_decayOsc, x, y, p0=p0, bounds=bounds)
+
+    if plot:
+        plt.plot(x, y, '.k')
+        plt.plot(x, func_decayOsc(x, *popt), '-r')
+        plt.show()
+
+    return popt, pcov
+
+
+## function to fit T1 decays
+## guesses that are not given are estimated from the data, all parameters are fitted
+def fit_T1(x, y, rate=None, off=None, amp=None, plot=False, bounds=None):
+
+    p0 = [g if g is not None else e
+          for g, e in zip([rate, off, amp], guess_exp(x, y))]
+    if bounds is None:
+        popt, pcov = opt.curve_fit(func_exp, x, y, p0=p0)
+    else:
+        popt, pcov = opt.curve_fit(func_exp, x, y, p0=p0, bounds=bounds)
+
+    if plot:
+        plt.plot(x, y, '.k')
+        plt.plot(x, func_exp(x, *popt), '-r')
+        plt.show()
+
+    return popt, pcov
+
+
+## analytic Jacobians of the model functions, one row per fit parameter
+## (same order as in the function signature), used by the batch fitting below
+def _stack(*rows):
+    return np.stack(np.broadcast_arrays(*rows), axis=-2)
+
+def jac_osc(x, freq, phase, amp=1, off=0):
+    c, s = np.cos(freq * x + phase), np.sin(freq * x + phase)
+    return _stack(-amp * x * s, -amp * s, c, np.ones_like(x))
+
+def jac_decayOsc(x, freq, phase, rate, amp=1, off=-0.5):
+    e = np.exp(-rate * x)
+    c, s = np.cos(freq * x + phase) * e, np.sin(freq * x + phase) * e
+    return _stack(-amp * x * s, -amp * s, -amp * x * c, c, np.ones_like(x))
+
+def jac_exp(x, rate, off, amp=1):
+    e = np.exp(-rate * x)
+    return _stack(-amp * x * e, np.ones_like(x), e)
+
+def jac_lorentz(x, width, pos, amp, off=0):
+    d = x - pos
+    den = width**2 + d**2
+    return _stack(2 * amp * width * d**2 / den**2, 2 * amp * width**2 * d / den**2,
+                  width**2 / den, np.ones_like(x))
+
+def jac_invLorentz(x, width, pos, amp, off=1):
+    j = jac_lorentz(x, width, pos, amp)
+    j[..., :3, :] *= -1
+    return j
+
+def jac_Fano(x, width, pos, amp, fano=0, off=.5):
+    d = x - pos
+    den = width**2 + d**2
+    num = fano * width + d
+    return _stack(amp * (2 * fano * num * den - 2 * width * num**2) / den**2,
+                  amp * (2 * d * num**2 - 2 * num * den) / den**2,
+                  num**2 / den, 2 * amp * width * num / den, np.ones_like(x))
+
+_jacobians = {
+    func_osc: jac_osc,
+    func_decayOsc: jac_decayOsc,
+    func_exp: jac_exp,
+    func_lorentz: jac_lorentz,
+    func_invLorentz: jac_invLorentz,
+    func_Fano: jac_Fano,
+}
+
+
+## function to fit many traces at once with the same model
+## x: common sweep axis (n_points) or one axis per trace (n_traces, n_points)
+## Y: traces (n_traces, n_points); p0: initial guess (n_params) or (n_traces, n_params)
+## Parameters not given in p0 keep the default value of the model function, as with curve_fit.
+## Without p0, all parameters are fitted, starting from the guesses estimated for each trace.
+## Every trace is fitted by its own Levenberg-Marquardt iteration, but all steps are
+## computed together as array operations. Returns popt (n_traces, n_params) and
+## pcov (n_traces, n_params, n_params), scaled like curve_fit with absolute_sigma=False.
+def fit_batch(func, x, Y, p0=None, max_iter=200, ftol=1.49e-8, xtol=1.49e-8, lam=1e-3):
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    if p0 is None:
+        p0 = _guesses[func](x, Y)
+    n_traces, n_points = Y.shape
+    x = np.broadcast_to(np.asarray(x, dtype=float), Y.shape)
+    popt = np.array(np.broadcast_to(np.asarray(p0, dtype=float), (n_traces, np.shape(p0)[-1])))
+    n_params = popt.shape[1]
+    jac = _jacobians[func]
+
+    def residuals(idx, p):
+        return Y[idx] - func(x[idx], *p.T[:, :, None])
+
+    def jacobian(idx, p):
+        return jac(x[idx], *p.T[:, :, None])[:, :n_params]
+
+    res = residuals(slice(None), popt)
+    cost = np.sum(res**2, axis=1)
+    lam = np.full(n_traces, lam)
+    active = np.arange(n_traces)
+
+    for _ in range(max_iter):
+        if active.size == 0:
+            break
+        p = popt[active]
+        J = jacobian(active, p)
+        JTJ = J @ J.transpose(0, 2, 1)
+        grad = (J @ res[active][..., None])[..., 0]
+
+        # damped normal equations, scaled by the curvature of each parameter
+        diag = np.einsum('mpp->mp', JTJ)
+        A = JTJ.copy()
+        A[:, np.arange(n_params), np.arange(n_params)] += lam[active, None] * (diag + 1e-12)
+        try:
+            step = np.linalg.solve(A, grad[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.einsum('mpq,mq->mp', np.linalg.pinv(A), grad)
+
+        p_new = p + step
+        res_new = residuals(active, p_new)
+        cost_new = np.sum(res_new**2, axis=1)
+
+        improved = cost_new < cost[active]
+        small = (cost[active] - cost_new <= ftol * cost[active]) | \
+                (np.linalg.norm(step, axis=1) <= xtol * (np.linalg.norm(p, axis=1) + xtol))
+        done = (improved & small) | (lam[active] > 1e10)
+
+        upd = active[improved]
+        popt[upd] = p_new[improved]
+        res[upd] = res_new[improved]
+        cost[upd] = cost_new[improved]
+        lam[active] = np.where(improved, lam[active] / 10, lam[active] * 10)
+        active = active[~done]
+
+    J = jacobian(slice(None), popt)
+    JTJ = J @ J.transpose(0, 2, 1)
+    dof = max(n_points - n_params, 1)
+    pcov = np.linalg.pinv(JTJ) * (cost / dof)[:, None, None]
+
+    return popt, pcov
+
+
+## benchmark of the estimated initial guesses against hand-seeded ones on simulated traces
+## The hand-seeded path starts from the true parameters, each perturbed by a random
+## relative error of up to seed_error, which mimics guesses read off a plot by eye.
+## Returns, for both paths, the mean number of function evaluations of successful
+## fits and the failure rate (no convergence, or residuals clearly above the noise,
+## i.e. a local minimum). The noise is given relative to the peak-to-peak signal.
+def benchmark_guesses(func, x, p_true, noise=0.05, n_traces=200, seed_error=0.3, seed=None):
+    rng = np.random.default_rng(seed)
+    p_true = np.asarray(p_true, dtype=float)
+    y_true = func(x, *p_true)
+    sigma = noise * np.ptp(y_true)
+    guess = _guesses[func]
+    results = {}
+    for path in ['hand-seeded', 'estimated']:
+        nfev, failed = [], 0
+        for _ in range(n_traces):
+            y = y_true + sigma * rng.standard_normal(x.size)
+            if path == 'hand-seeded':
+                p0 = p_true * (1 + seed_error * rng.uniform(-1, 1, p_true.size))
+            else:
+                p0 = guess(x, y)[:p_true.size]
+            try:
+                popt, _, info, _, _ = opt.curve_fit(func, x, y, p0=p0, full_output=True)
+            except RuntimeError:
+                failed += 1
+                continue
+            if np.sqrt(np.mean((y - func(x, *popt))**2)) > 1.5 * sigma:
+                failed += 1
+            else:
+                nfev.append(info['nfev'])
+        results[path] = {'nfev': np.mean(nfev) if nfev else np.nan, 'failure_rate': failed / n_traces}
+    return results
+
+
+## function to fit while averages are being acquired
+## averages: iterable of traces, e.g. single averages as they arrive from the instrument;
+## each new trace is added to the running mean (or, with running_mean=False, the traces
+## are taken as the partial averages themselves) and the model is re-fitted, starting
+## from the parameters of the previous fit (or from p0 / the estimated guesses).
+## tol: dict of parameter name and target standard deviation, e.g. {'freq': 1e-3}.
+## Yields (n_averages, popt, pcov, done) after every fit, where done tells that all
+## parameters in tol are known well enough; stop acquiring (break) once it is True.
+## popt and pcov are None while the fit does not converge yet.
+def fit_incremental(func, x, averages, p0=None, tol=None, running_mean=True, bounds=None):
+    names = list(inspect.signature(func).parameters)[1:]
+    tol = tol or {}
+    mean = None
+
+    for n, trace in enumerate(averages, start=1):
+        trace = np.asarray(trace, dtype=float)
+        if not running_mean:
+            mean = trace
+        elif mean is None:
+            mean = trace.copy()
+        else:
+            mean += (trace - mean) / n
+
+        if p0 is None:
+            p0 = _guesses[func](x, mean)
+        try:
+            if bounds is None:
+                popt, pcov = opt.curve_fit(func, x, mean, p0=p0)
+            else:
+                popt, pcov = opt.curve_fit(func, x, mean, p0=p0, bounds=bounds)
+        except RuntimeError:
+            yield n, None, None, False
+            continue
+
+        p0 = popt
+        perr = np.sqrt(np.abs(np.diag(pcov)))
+        done = all(perr[names.index(name)] < limit for name, limit in tol.items())
+        yield n, popt, pcov, done
+
+
+## job types of the parallel fitting below, with the fit function and model of each
+fit_jobs = {
+    'rabi': (fit_Rabi, func_osc),
+    'spec': (fit_Spec, func_lorentz),
+    'resspec': (fit_ResSpec, func_Fano),
+    'ramsey': (fit_Ramsey, func_decayOsc),
+    't1': (fit_T1, func_exp),
+}
+
+def _run_fit_chunk(chunk):
+    # runs in the worker processes, never plots
+    results = []
+    for i, (job, x, y, options) in chunk:
+        try:
+            popt, pcov = fit_jobs[job][0](x, y, **dict(options or {}, plot=False))
+            results.append((i, popt, pcov, None))
+        except (RuntimeError, ValueError, np.linalg.LinAlgError) as err:
+            results.append((i, None, None, err))
+    return results
+
+
+## function to run many fits in parallel, e.g. all fits of a multi-qubit tuneup
+## jobs: iterable of (job, x, y, options) with job one of the keys of fit_jobs and
+## options a dict of keyword arguments for the fit function (or None).
+## Jobs are sent to a pool of worker processes in chunks of chunksize and taken from the
+## iterable only as workers become free, so it can be fed while the fits are running.
+## Yields (index, popt, pcov, error) in the order the fits finish; error is the exception
+## of a failed fit (popt and pcov are None then). With plot=True, the fits are plotted
+## here in the calling process.
+def fit_parallel(jobs, max_workers=None, chunksize=4, plot=False):
+    max_workers = max_workers or os.cpu_count() or 1
+    jobs = enumerate(jobs)
+    pending = set()
+    shown = {}
+
+    with cf.ProcessPoolExecutor(max_workers) as pool:
+        def submit():
+            chunk = list(itertools.islice(jobs, chunksize))
+            if chunk:
+                pending.add(pool.submit(_run_fit_chunk, chunk))
+                if plot:
+                    shown.update({i: job for i, job in chunk})
+            return bool(chunk)
+
+        # keep two chunks in flight per worker
+        for _ in range(2 * max_workers):
+            if not submit():
+                break
+
+        while pending:
+            done, _ = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                submit()
+                for i, popt, pcov, err in future.result():
+                    if plot and err is None:
+                        job, x, y, _ = shown.pop(i)
+                        plt.plot(x, y, '.k')
+                        plt.plot(x, fit_jobs[job][1](x, *popt), '-r')
+                        plt.show()
+                    yield i, popt, pcov, err
@@ -7,23 +7,198 @@ import numpy as np
 import matplotlib.pyplot as plt
 import textwrap
 import time
+import re
+from collections import OrderedDict
 
 
-def write_crosstalk_matrix(daq, device, matrix):
+def read_crosstalk_matrix(daq, device):
+    """
+    Reads the QA Setup crosstalk matrix of the UHFQA with a single request.
+
+    Arguments:
+        daq (zhinst.ziDAQServer) -- Connection to the Data Server
+        device (String) -- device ID, e.g. "dev2266"
+
+    Returns:
+        (2D array) -- 10x10 crosstalk matrix, NaN for elements not returned
+    """
+    matrix = np.full((10, 10), np.nan)
+    data = daq.get(f"/{device}/qas/0/crosstalk/rows", True)
+    prefix = f"/{device}/qas/0/crosstalk/rows/".lower()
+    for path, node in data.items():
+        path = path.lower()
+        if not path.startswith(prefix):
+            continue
+        r, _, c = path[len(prefix):].split("/")
+        matrix[int(r), int(c)] = node["value"][0]
+    return matrix
+
+
+def write_crosstalk_matrix(daq, device, matrix, force=False):
     """
     Writes the given matrix to the QA Setup crosstalk matrix of the UHFQA.
+    The current matrix is read back first and only the elements that 
+    changed are written, all in one transaction.
 
     Arguments:
         daq (zhinst.ziDAQServer) -- Connection to the Data Server
         device (String) -- device ID, e.g. "dev2266"
         matrix (2D array) -- crosstalk matrix to be written to the QA Setup tab
+
+    Keyword Arguments:
+        force (bool) -- write all elements without reading back (default: False)
+
+    Returns:
+        (int) -- number of elements written
     """
+    matrix = np.asarray(matrix, dtype=float)
     rows, cols = matrix.shape
-    for r in range(rows):
-        for c in range(cols):
-            node = f"/{device}/qas/0/crosstalk/rows/{r}/cols/{c}"
-            daq.setDouble(node, matrix[r, c])
-    return
+    if force:
+        changed = np.ones((rows, cols), dtype=bool)
+    else:
+        current = read_crosstalk_matrix(daq, device)[:rows, :cols]
+        changed = ~np.isclose(current, matrix, rtol=1e-9, atol=1e-12)
+
+    settings = [
+        (f"/{device}/qas/0/crosstalk/rows/{r}/cols/{c}", matrix[r, c])
+        for r, c in zip(*np.nonzero(changed))
+    ]
+    if settings:
+        daq.set(settings)
+    return len(settings)
+
+
+class SeqcTemplate:
+    """
+    AWG sequence program with placeholders, parsed once and rendered 
+    in a single pass. Rendered programs are memoized by their parameters, 
+    so that generating the same program again costs a dictionary lookup.
+
+    Arguments:
+        text (String) -- sequence program with placeholders
+        fields (dict) -- placeholder tokens in the text and the names 
+                         of the parameters replacing them, 
+                         e.g. {"_nAverages_": "n_averages"}
+
+    Keyword Arguments:
+        max_cached (int) -- maximum number of memoized programs 
+                            (default: 1024)
+    """
+
+    def __init__(self, text, fields, max_cached=1024):
+        # longest tokens first, so that a token containing another one wins
+        tokens = sorted(fields, key=len, reverse=True)
+        pattern = re.compile("|".join(re.escape(token) for token in tokens))
+        # alternating literal text and parameter names
+        self._literals = []
+        self._names = []
+        position = 0
+        for match in pattern.finditer(text):
+            self._literals.append(text[position:match.start()])
+            self._names.append(fields[match.group()])
+            position = match.end()
+        self._literals.append(text[position:])
+        self.max_cached = max_cached
+        self._cache = OrderedDict()
+
+    def render(self, **params):
+        """
+        Returns the program with the placeholders replaced by the 
+        string representation of the parameters.
+
+        Keyword Arguments:
+            **params -- value of each parameter named in the fields
+
+        Returns:
+            (String) -- rendered sequence program
+        """
+        values = tuple(str(params[name]) for name in self._names)
+        program = self._cache.get(values)
+        if program is not None:
+            self._cache.move_to_end(values)
+            return program
+
+        parts = [None] * (2 * len(values) + 1)
+        parts[::2] = self._literals
+        parts[1::2] = values
+        program = "".join(parts)
+
+        self._cache[values] = program
+        if len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+        return program
+
+
+# hard coded parameters for pulse parameters here... for ground and excited state (+ delta)
+_READOUT_AMPLITUDES = np.array([0.13, 0.15, 0.16, 0.15, 0.14, 0.13, 0.17, 0.23, 0.19, 0.11])/20
+_READOUT_DELTAS_AMPLITUDE = np.array([0.02, 0.01, -0.01, 0.02, -0.012, 0.0, 0.02, -0.012, 0.06, 0.03]) 
+_READOUT_DELTAS_PHASE = np.array([0.23, 0.31, 0.26, -0.171, 0.28, -0.31, 0.19, -0.21, 0.091, 0.29]) * np.pi /4
+
+# text snippet for the initialization of awg sequence
+_READOUT_INIT = textwrap.dedent(
+    """\
+    const samplingRate = 1.8e9;
+    // parameters for envelope
+    const riseTime = 30e-9;
+    const fallTime = 30e-9;
+    const flatTime = 200e-9;
+    const rise = riseTime * samplingRate;
+    const fall = fallTime * samplingRate;
+    const length = flatTime * samplingRate;
+    const totalLength =  rise + length + fall;
+    // define waveforms
+    wave w_gauss_rise = gauss(2*rise, rise, rise/4);
+    wave w_gauss_fall = gauss(2*fall, fall, fall/4);
+    wave w_rise = cut(w_gauss_rise, 0, rise);
+    wave w_fall = cut(w_gauss_fall, fall, 2*fall-1);
+    wave w_flat = rect(length, 1.0); 
+    wave w_pad = zeros((totalLength-1)%16);
+    // combine to total envelope
+    wave readoutPulse = 1.0*join(w_rise, w_flat, w_fall, w_pad) + 0.0* w_gauss_rise;
+
+    // init empty final waveforms
+    wave w_I = zeros(totalLength);
+    wave w_Q = zeros(totalLength);
+
+"""
+)
+
+# text snippet for single pulse
+_READOUT_PULSE = SeqcTemplate(
+    textwrap.dedent(
+        """\
+        // modulate envelope for readout pulse *N*
+        const f*N*_readout = _Frequency*N*_ ;
+        wave w*N*_I =  _Amplitude*N*_ * readoutPulse * cosine(totalLength, 1, _Phase*N*_, f*N*_readout*totalLength/samplingRate);
+        wave w*N*_Q = _Amplitude*N*_ * readoutPulse * sine(totalLength, 1, _Phase*N*_, f*N*_readout*totalLength/samplingRate);
+        w_I = add(w_I, w*N*_I);
+        w_Q = add(w_Q, w*N*_Q);
+
+    """
+    ),
+    {"*N*": "channel", "_Frequency*N*_": "frequency", "_Amplitude*N*_": "amplitude", "_Phase*N*_": "phase"},
+)
+
+# text snippet for main loop of .seqC
+_READOUT_PLAY = SeqcTemplate(
+    textwrap.dedent(
+        """\
+        // play waveform
+        setTrigger(AWG_INTEGRATION_ARM);
+        var result_averages = _nAverages_ ;
+        repeat (result_averages) {
+            playWave(w_I, w_Q);
+            setTrigger(AWG_INTEGRATION_ARM + AWG_INTEGRATION_TRIGGER + AWG_MONITOR_TRIGGER + 1);
+            setTrigger(AWG_INTEGRATION_ARM);
+            waitWave();
+            wait(1024);
+        }
+        setTrigger(0);
+
+    """
+    ),
+    {"_nAverages_": "n_averages"},
+)
 
 
 def sequence_multiplexed_readout(
@@ -38,6 +213,8 @@ def sequence_multiplexed_readout(
     are hardcoded in the function for up to 10 channels and for 
     ground and excited qubit states (simulated response of a 
     readout resonator for qubit in either ground or excited state).
+    The program is rendered from templates parsed once; programs 
+    already generated are returned from the cache of the templates.
 
     Arguments:
         channels (int) -- indices of channels to create readout pulses for
@@ -51,11 +228,8 @@ def sequence_multiplexed_readout(
         (String) -- awg sequence program as string
     """
 
-    # hard coded parameters for pulse parameters here... for ground and excited state (+ delta)
-    amplitudes = np.array([0.13, 0.15, 0.16, 0.15, 0.14, 0.13, 0.17, 0.23, 0.19, 0.11])/20
+    amplitudes = _READOUT_AMPLITUDES.copy()
     phases = np.zeros(10)
-    deltas_amplitude = np.array([0.02, 0.01, -0.01, 0.02, -0.012, 0.0, 0.02, -0.012, 0.06, 0.03]) 
-    deltas_phase = np.array([0.23, 0.31, 0.26, -0.171, 0.28, -0.31, 0.19, -0.21, 0.091, 0.29]) * np.pi /4
     
     n_channels = len(channels)
     assert len(frequencies) >= max(channels), "Not enough readout frequencies specified!"
@@ -68,92 +242,22 @@ def sequence_multiplexed_readout(
             frequencies[ch] = abs(frequencies[ch])
             # decide what to do here
         if state[i]:
-            amplitudes[ch] = amplitudes[ch] * (1 + deltas_amplitude[ch])
-            phases[ch] += deltas_phase[ch]
-    
-    # text snippet for the initialization of awg sequence
-    awg_program_init = textwrap.dedent(
-        """\
-        const samplingRate = 1.8e9;
-        // parameters for envelope
-        const riseTime = 30e-9;
-        const fallTime = 30e-9;
-        const flatTime = 200e-9;
-        const rise = riseTime * samplingRate;
-        const fall = fallTime * samplingRate;
-        const length = flatTime * samplingRate;
-        const totalLength =  rise + length + fall;
-        // define waveforms
-        wave w_gauss_rise = gauss(2*rise, rise, rise/4);
-        wave w_gauss_fall = gauss(2*fall, fall, fall/4);
-        wave w_rise = cut(w_gauss_rise, 0, rise);
-        wave w_fall = cut(w_gauss_fall, fall, 2*fall-1);
-        wave w_flat = rect(length, 1.0); 
-        wave w_pad = zeros((totalLength-1)%16);
-        // combine to total envelope
-        wave readoutPulse = 1.0*join(w_rise, w_flat, w_fall, w_pad) + 0.0* w_gauss_rise;
-
-        // init empty final waveforms
-        wave w_I = zeros(totalLength);
-        wave w_Q = zeros(totalLength);
-
-    """
-    )
-
-    # text snippet for single pulse
-    awg_program_singlePulse = textwrap.dedent(
-        """\
-        // modulate envelope for readout pulse *N*
-        const f*N*_readout = _Frequency*N*_ ;
-        wave w*N*_I =  _Amplitude*N*_ * readoutPulse * cosine(totalLength, 1, _Phase*N*_, f*N*_readout*totalLength/samplingRate);
-        wave w*N*_Q = _Amplitude*N*_ * readoutPulse * sine(totalLength, 1, _Phase*N*_, f*N*_readout*totalLength/samplingRate);
-        w_I = add(w_I, w*N*_I);
-        w_Q = add(w_Q, w*N*_Q);
-
-    """
-    )
-
-    # text snippet for main loop of .seqC
-    awg_program_playWave = textwrap.dedent(
-        """\
-        // play waveform
-        setTrigger(AWG_INTEGRATION_ARM);
-        var result_averages = _nAverages_ ;
-        repeat (result_averages) {
-            playWave(w_I, w_Q);
-            setTrigger(AWG_INTEGRATION_ARM + AWG_INTEGRATION_TRIGGER + AWG_MONITOR_TRIGGER + 1);
-            setTrigger(AWG_INTEGRATION_ARM);
-            waitWave();
-            wait(1024);
-        }
-        setTrigger(0);
-
-    """
-    )
+            amplitudes[ch] = amplitudes[ch] * (1 + _READOUT_DELTAS_AMPLITUDE[ch])
+            phases[ch] += _READOUT_DELTAS_PHASE[ch]
 
     # add all the pulses for N = ... readout channels
-    # add each channel and replace indices for readout frequencies ...
-    awg_program_pulses = ""
-    for ch in channels:
-        awg_program_pulses = awg_program_pulses + awg_program_singlePulse.replace(
-            "*N*", str(ch)
-        )
-
-    # replace parameters in sequence program
-    awg_program_pulses = awg_program_pulses.replace("_nChannels_", str(n_channels))
-    for ch in channels:
-        awg_program_pulses = awg_program_pulses.replace(
-            f"_Frequency{ch}_", str(frequencies[ch])
-        )
-        awg_program_pulses = awg_program_pulses.replace(
-            f"_Amplitude{ch}_", str(amplitudes[ch])
+    awg_program_pulses = "".join(
+        _READOUT_PULSE.render(
+            channel=ch,
+            frequency=frequencies[ch],
+            amplitude=amplitudes[ch],
+            phase=phases[ch],
         )
-        awg_program_pulses = awg_program_pulses.replace(
-            f"_Phase{ch}_", str(phases[ch])
-        )
-    awg_program_playWave = awg_program_playWave.replace("_nAverages_", str(n_averages))
+        for ch in channels
+    )
+    awg_program_playWave = _READOUT_PLAY.render(n_averages=n_averages)
 
-    return awg_program_init + awg_program_pulses + awg_program_playWave
+    return _READOUT_INIT + awg_program_pulses + awg_program_playWave
 
 
 def compile_sequence(awg_module, awg_program):
@@ -174,12 +278,75 @@ def compile_sequence(awg_module, awg_program):
         print("Compilation successful!")
 
 
+class DemodWeightBank:
+    """
+    Cache of complex demodulation vectors exp(i*2*pi*f*n/fs) of 4096 
+    samples, one per frequency and sampling rate, with the least 
+    recently used ones evicted. Other phases and shorter lengths are 
+    obtained from the cached vectors by a complex multiplication and 
+    slicing, without evaluating trigonometric functions again.
+
+    Keyword Arguments:
+        max_entries (int) -- maximum number of cached frequencies 
+                             (default: 64)
+    """
+
+    length = 4096
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+
+    def phasors(self, frequency, samplingRate=1.8e9):
+        """
+        Returns the cached demodulation vector at zero phase, read-only.
+
+        Arguments:
+            frequency (float) -- demodulation frequency (in Hz)
+
+        Keyword Arguments:
+            samplingRate (float) -- sampling rate (default: 1.8e9)
+        """
+        key = (float(frequency), float(samplingRate))
+        vector = self._cache.get(key)
+        if vector is not None:
+            self._cache.move_to_end(key)
+            return vector
+
+        x = np.arange(0, self.length)
+        vector = np.exp(1j * (2 * np.pi * frequency * x / samplingRate))
+        vector.flags.writeable = False
+        self._cache[key] = vector
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return vector
+
+    def weights(self, length, frequency, samplingRate=1.8e9, phase=0):
+        """
+        Returns both quadratures of the demodulation as a complex vector, 
+        cos(2*pi*f*n/fs + phase) + i*sin(2*pi*f*n/fs + phase).
+
+        Arguments:
+            length (int) -- number of samples, max. 4096
+            frequency (float) -- demodulation frequency (in Hz)
+
+        Keyword Arguments:
+            samplingRate (float) -- sampling rate (default: 1.8e9)
+            phase (float) -- phase offset in radians (default: 0)
+        """
+        assert length <= self.length
+        vector = self.phasors(frequency, samplingRate)[:length]
+        return vector * np.exp(1j * phase)
+
+
+# demodulation vectors shared by the helper functions
+demod_weight_bank = DemodWeightBank()
+
+
 def generate_demod_weights(length, frequency, samplingRate=1.8e9, plot=False, phase=0):
     assert length <= 4096
     assert frequency > 0
-    x = np.arange(0, length)
-    y = np.sin(2 * np.pi * frequency * x / samplingRate + phase)
-    return y
+    return demod_weight_bank.weights(length, frequency, samplingRate, phase).imag
 
 
 def run_awg(daq, device):
@@ -220,6 +387,107 @@ def toggle_outputs(daq, device, channel=None):
             daq.setInt(path, 0)
 
 
+# host-side mirror of the integration weights, by connection and device
+_integration_mirrors = {}
+
+
+def _integration_mirror(daq, device):
+    key = (id(daq), device.lower())
+    mirror = _integration_mirrors.get(key)
+    if mirror is None or mirror["daq"] is not daq:
+        # weights and length unknown (None) until written by these functions
+        mirror = {"daq": daq, "weights": {}, "length": None, "monitor_length": None}
+        _integration_mirrors[key] = mirror
+    return mirror
+
+
+def forget_integration_weights(daq, device):
+    """
+    Forgets the integration weights remembered for the device, e.g. after 
+    they were changed from the user interface. The next upload of each 
+    channel resets it completely.
+
+    Arguments:
+        daq (zhinst.ziDAQServer) -- Data Server Object
+        device (String) -- device ID, e.g. "dev2266"
+    """
+    _integration_mirrors.pop((id(daq), device.lower()), None)
+
+
+def _integration_weights_settings(device, mirror, weights, integration_length):
+    """
+    Returns the settings that bring the weight memories to the given 
+    weights followed by zeros, and the integration length to the given 
+    value. Only the memories that differ are written, and only as far 
+    as needed to overwrite the previous content.
+    """
+    vectors = []
+    for (channel, quadrature), values in weights.items():
+        known = mirror["weights"].get((channel, quadrature))
+        if known is None:
+            # unknown content, overwrite the whole memory
+            end = 4096
+        else:
+            target = np.zeros(4096)
+            target[:len(values)] = values
+            different = np.flatnonzero(known != target)
+            if different.size == 0:
+                continue
+            end = different[-1] + 1
+        vector = np.zeros(max(end, len(values)))
+        vector[:len(values)] = values
+        vectors.append((f"/{device}/qas/0/integration/weights/{channel}/{quadrature}", vector))
+
+    # the vectors are written with an integration length covering them
+    settings = []
+    length_node = f"/{device}/qas/0/integration/length"
+    length = mirror["length"]
+    longest = max([len(vector) for _, vector in vectors], default=0)
+    if vectors and (length is None or length < longest):
+        length = max(longest, integration_length)
+        settings.append((length_node, length))
+    settings += vectors
+    if length != integration_length:
+        settings.append((length_node, integration_length))
+    return settings
+
+
+def _apply_integration_weights(daq, device, mirror, weights, integration_length):
+    settings = _integration_weights_settings(device, mirror, weights, integration_length)
+    if settings:
+        daq.set(settings)
+    for key, values in weights.items():
+        known = np.zeros(4096)
+        known[:len(values)] = values
+        mirror["weights"][key] = known
+    mirror["length"] = integration_length
+
+
+def _monitor_length(daq, device, mirror):
+    if mirror["monitor_length"] is None:
+        mirror["monitor_length"] = daq.getInt(f"/{device}/qas/0/monitor/length")
+    return mirror["monitor_length"]
+
+
+def _integration_weights(weights, monitor_length, demod_frequency=None):
+    """Weights cut to the monitor length and multiplied by the demodulation"""
+    weights = np.asarray(weights, dtype=float)
+    assert len(weights) <= 4096
+
+    # if weight is only one point, set constant weight for total length
+    if len(weights) == 1:
+        weights = weights * np.ones(monitor_length)
+
+    # set lengths to the same, smallest value
+    integration_length = min(len(weights), monitor_length)
+    weights = weights[:integration_length]
+
+    # generate weights for digital demodulation
+    if demod_frequency is not None:
+        return weights * generate_demod_weights(integration_length, demod_frequency)
+    return weights
+
+
 def set_integration_weights(
     daq,
     device,
@@ -231,6 +499,9 @@ def set_integration_weights(
     """
     Sets the integration weights of the UHFQA. The input signals 
     are multiplied with the integrtion weights for each channel.
+    The weights are remembered on the host: they are not sent again 
+    if unchanged, and the rest of the weight memory is cleared only 
+    as far as it held older weights.
 
     Arguments:
         daq (zhinst.ziDAQServer) -- Data Server Object
@@ -245,51 +516,53 @@ def set_integration_weights(
         demod_frequency (double) -- frequency for demodulation 
                                     (default: None)
     """
+    set_integration_weights_multi(
+        daq,
+        device,
+        {(channel, quadrature): weights},
+        demod_frequencies={channel: demod_frequency},
+    )
 
-    monitor_length = daq.getInt(f"/{device}/qas/0/monitor/length")
-    integration_length = len(weights)
-    assert integration_length <= 4096
-    assert channel in range(10)
-    assert quadrature in ["real", "imag"]
-
-    # if weight is only one point, set constant weight for total length
-    if len(weights) == 1:
-        weights = weights * np.ones(monitor_length)
 
-    # set lengths to the same, smallest value
-    if integration_length > monitor_length:
-        weights = weights[:monitor_length]
-        integration_length = monitor_length
-    if integration_length < monitor_length:
-        monitor_length = integration_length
+def set_integration_weights_multi(daq, device, weights, demod_frequencies=None):
+    """
+    Sets the integration weights of several channels and quadratures 
+    in a single transfer, like set_integration_weights. The integration 
+    length is shared by all channels, so all the weights need the same 
+    length.
 
-    # generate weights for digital demodulation
-    if demod_frequency is not None:
-        demod_weights = generate_demod_weights(integration_length, demod_frequency)
-    else:
-        demod_weights = np.ones(integration_length)
+    Arguments:
+        daq (zhinst.ziDAQServer) -- Data Server Object
+        device (String) -- device ID, e.g. "dev2266"
+        weights (dict) -- weights of each (channel, quadrature), 
+                          e.g. {(0, 'real'): w_I, (0, 'imag'): w_Q}
 
-    # generate weights
-    integration_weights = weights * demod_weights
+    Keyword Arguments:
+        demod_frequencies (dict) -- frequency for demodulation of each 
+                                    channel (default: None)
+    """
+    demod_frequencies = demod_frequencies or {}
+    mirror = _integration_mirror(daq, device)
+    monitor_length = _monitor_length(daq, device, mirror)
+
+    integration_weights = {}
+    for (channel, quadrature), values in weights.items():
+        assert channel in range(10)
+        assert quadrature in ["real", "imag"]
+        integration_weights[(channel, quadrature)] = _integration_weights(
+            values, monitor_length, demod_frequencies.get(channel)
+        )
+    lengths = {len(values) for values in integration_weights.values()}
+    assert len(lengths) == 1, "All the weights need the same length!"
 
-    # reset
-    daq.setInt(f"/{device}/qas/0/integration/length", 4096)
-    daq.setVector(
-        f"/{device}/qas/0/integration/weights/{channel}/{quadrature}",
-        np.zeros(4096),
-    )
-    # set 
-    daq.setInt(f"/{device}/qas/0/integration/length", integration_length)
-    daq.setVector(
-        f"/{device}/qas/0/integration/weights/{channel}/{quadrature}",
-        integration_weights,
-    )
+    _apply_integration_weights(daq, device, mirror, integration_weights, lengths.pop())
 
 
 def reset_integration_weights(daq, device, channels=range(10)):
     """
     Resets the integration weights of the UHFQA to all zeros. 
-    If no channel specified all are reset.
+    If no channel specified all are reset. Only the weights that 
+    are not known to be zero already are cleared, in a single transfer.
 
     Arguments:
         daq (zhinst.ziDAQServer) -- Data Server Object
@@ -299,17 +572,13 @@ def reset_integration_weights(daq, device, channels=range(10)):
         channels (int) --  list of indeces of channels to be reset 
                              (default: range(10))
     """
-
-    daq.setInt(f"/{device}/qas/0/integration/length", 4096)
-    for ch in channels:
-        daq.setVector(
-            f"/{device}/qas/0/integration/weights/{ch}/real",
-            np.zeros(4096),
-        )
-        daq.setVector(
-            f"/{device}/qas/0/integration/weights/{ch}/imag",
-            np.zeros(4096),
-        )
+    mirror = _integration_mirror(daq, device)
+    zeros = {
+        (ch, quadrature): np.zeros(0)
+        for ch in channels
+        for quadrature in ["real", "imag"]
+    }
+    _apply_integration_weights(daq, device, mirror, zeros, 4096)
 
 
 def set_qa_results(daq, device, result_length, result_averages, source="integration"):
@@ -324,7 +593,7 @@ def set_qa_results(daq, device, result_length, result_averages, source="integrat
 
     Keyword Arguments:
         source (str) -- specifies data source of QA 
-                        "integratio", "rotation" or "threshold" 
+                        "integratio", "rotation", "crosstalk" or "threshold" 
                         (default: "integration")
     """
 
@@ -332,6 +601,8 @@ def set_qa_results(daq, device, result_length, result_averages, source="integrat
         source = 7
     elif source == "rotation":
         source = 2
+    elif source == "crosstalk":
+        source = 0
     elif source == "threshold":
         source = 1
 
@@ -365,6 +636,7 @@ def set_qa_monitor(daq, device, monitor_length, averages):
         ("qas/0/monitor/enable", 1),
     ]
     daq.set([(f"/{device}/{node}", value) for node, value in settings])
+    _integration_mirror(daq, device)["monitor_length"] = monitor_length
 
 
 def optimal_integration_weights(
@@ -456,11 +728,8 @@ def optimal_integration_weights(
         weights_I[:delay] = 0
         weights_Q[:delay] = 0
 
-    set_integration_weights(
-        daq, device, weights_I, channel, quadrature="real"
-    )
-    set_integration_weights(
-        daq, device, weights_Q, channel, quadrature="imag"
+    set_integration_weights_multi(
+        daq, device, {(channel, "real"): weights_I, (channel, "imag"): weights_Q}
     )
 
     if plot:
@@ -493,6 +762,296 @@ def optimal_integration_weights(
         plt.show()
 
 
+def separate_channels(traces, frequencies, samplingRate=1.8e9, tolerance=1e-10, max_iterations=1000):
+    """
+    Separates the contributions of multiplexed readout tones to the 
+    given traces by least squares over the known readout frequencies. 
+    Each tone has its own amplitude and phase in every trace and is 
+    multiplied by an envelope common to all tones and traces, as the 
+    readout pulses played together by the AWG. The amplitudes and phases, 
+    and then the envelope sample by sample, are fitted in turn until the 
+    residual stops decreasing. Unlike a low-pass filter, the separation is 
+    not limited by the frequency spacing relative to the pulse length; 
+    deviations of a channel from the common envelope are not resolved. 
+    A tone received 100 kHz off its readout frequency lowers the 
+    correlation of its weights with the per-channel ones to about 0.999, 
+    and at 1 MHz the separation fails for all channels. The fit is not 
+    convex either: it is checked with the amplitudes and phases of 
+    sequence_multiplexed_readout, and other amplitudes and phases can 
+    settle in a wrong separation even when the model holds.
+
+    Arguments:
+        traces (array) -- traces to separate, the last axis is time
+        frequencies (float) -- readout frequencies (in Hz) to separate
+
+    Keyword Arguments:
+        samplingRate (float) -- sampling rate of the traces (default: 1.8e9)
+        tolerance (float) -- decrease of the residual, relative to the 
+                             traces, below which the fit stops 
+                             (default: 1e-10)
+        max_iterations (int) -- maximum number of iterations (default: 1000)
+
+    Returns:
+        (array) -- contribution of each frequency, with shape 
+                   (len(frequencies),) + traces.shape
+    """
+    traces = np.asarray(traces, dtype=float)
+    frequencies = np.abs(np.asarray(frequencies, dtype=float))
+    length = traces.shape[-1]
+    X = traces.reshape(-1, length)
+
+    # quadratures of all frequencies, shape (2 * frequencies, time)
+    if length <= DemodWeightBank.length:
+        phasors = np.stack([demod_weight_bank.phasors(f, samplingRate)[:length] for f in frequencies])
+    else:
+        t = np.arange(length) / samplingRate
+        phasors = np.exp(2j * np.pi * frequencies[:, None] * t)
+    basis = np.concatenate([phasors.real, phasors.imag])
+
+    envelope = np.ones(length)
+    total = np.sum(X**2)
+    residual = np.inf
+    for _ in range(max_iterations):
+        # quadratures of each tone in each trace, with the envelope fixed
+        coefficients = np.linalg.lstsq((envelope * basis).T, X.T, rcond=None)[0]
+        tones = coefficients.T @ basis
+        # envelope of all traces, with the tones fixed
+        norm = np.sum(tones**2, axis=0)
+        envelope = np.sum(X * tones, axis=0) / (norm + 1e-12 * norm.max() + np.finfo(float).tiny)
+        previous, residual = residual, np.sum((X - envelope * tones) ** 2)
+        if previous - residual <= tolerance * total:
+            break
+
+    n = len(frequencies)
+    separated = envelope * (
+        coefficients[:n].T[:, :, None] * basis[:n] + coefficients[n:].T[:, :, None] * basis[n:]
+    )
+    return np.moveaxis(separated, 1, 0).reshape((n,) + traces.shape)
+
+
+def optimal_integration_weights_multiplexed(
+    daq,
+    device,
+    awg,
+    channels,
+    frequencies,
+    plot=False,
+    delay=None,
+):
+    """
+    Sets the optimal integration weights for all specified channels at 
+    once. Measures IQ traces with all channels in the ground and then in 
+    the excited state, separates the difference of each channel by a 
+    least-squares fit over the readout frequencies (see 
+    separate_channels) and uploads all the weights together. Two
+    measurements are needed, independently of the number of channels.
+
+    Arguments:
+        daq (zhinst.ziDAQServer) -- Data Server Object
+        device (String) -- device ID, e.g. "dev2266"
+        awg (awgModule) -- awgModule() Object of AWG
+        channels (int) -- indices of channels to set weights for
+        frequencies (float) -- list of readout frequencies for all channels
+
+    Keyword Arguments:
+        plot (bool) -- if set, the weights are plotted (default: False)
+        delay (int) -- number of samples at the beginning of weights array 
+                       that are set to 0 (default: None)
+
+    Returns:
+        (dict) -- weights I and Q of each channel
+    """
+
+    channels = list(channels)
+    daq.flush()
+    monitor_length = daq.getInt(f"/{device}/qas/0/monitor/length")
+    monitor_averages = daq.getInt(f"/{device}/qas/0/monitor/averages")
+
+    reset_integration_weights(daq, device, channels=channels)
+    monitor_paths = [
+        f"/{device}/qas/0/monitor/inputs/0/wave",
+        f"/{device}/qas/0/monitor/inputs/1/wave",
+    ]
+
+    traces = []
+    daq.subscribe(monitor_paths)
+    try:
+        for state in [[0] * len(channels), [1] * len(channels)]:
+            print(f"Channels {channels} in state |{','.join(str(num) for num in state)}>", flush=True)
+            # readout pulses for all channels
+            awg_program = sequence_multiplexed_readout(
+                channels,
+                frequencies,
+                monitor_averages,
+                state=state
+            )
+            compile_sequence(awg, awg_program)
+
+            # discard data from before the run
+            daq.sync()
+            time.sleep(0.1)
+            daq.poll(0.001, 10, 0, True)
+
+            run_awg(daq, device)
+            polldata = acquisition_poll(daq, monitor_paths, monitor_length)
+            traces.append([polldata[p] for p in monitor_paths])
+            print("\t\t--> Data acquired")
+    finally:
+        daq.unsubscribe(monitor_paths)
+
+    # difference of the I and Q traces, split by channel: (channels, 2, samples)
+    difference = np.asarray(traces[1], dtype=float) - np.asarray(traces[0], dtype=float)
+    separated = separate_channels(difference, [frequencies[ch] for ch in channels])
+    weights = separated / np.max(np.abs(separated), axis=-1, keepdims=True)
+    if delay is not None:
+        weights[..., :delay] = 0
+
+    upload = {}
+    for ch, (weights_I, weights_Q) in zip(channels, weights):
+        upload[(ch, "real")] = weights_I
+        upload[(ch, "imag")] = weights_Q
+    set_integration_weights_multi(daq, device, upload)
+
+    if plot:
+        fig, axes = plt.subplots(len(channels), figsize=[10, 2 * len(channels)], squeeze=False)
+        for ax, ch, (weights_I, weights_Q) in zip(axes[:, 0], channels, weights):
+            ax.grid("on")
+            if delay is not None:
+                ax.axvline(delay, c="k", linewidth=0.5)
+            ax.plot(weights_I, label="Weight I", color=plt.cm.tab20(0))
+            ax.plot(weights_Q, label="Weight Q", color=plt.cm.tab20(1))
+            ax.legend(frameon=False, loc=3)
+            ax.set_title(f"Integration weights of channel {ch}", position=[0.2, 0.7])
+            ax.set_xlim([0, monitor_length])
+        axes[-1, 0].set_xlabel("Samples")
+        plt.show()
+
+    return {ch: (weights_I, weights_Q) for ch, (weights_I, weights_Q) in zip(channels, weights)}
+
+
+class StreamingAcquisition:
+    """
+    Acquisition of subscribed paths into preallocated buffers. Every 
+    polled chunk is copied once into the buffer of its path, the number 
+    of samples received is kept as a counter, and the timeout is 
+    measured in wall-clock time.
+
+    In continuous mode the buffers are rings of `num_samples` samples, 
+    filled without end; the blocks yielded are views into the rings, 
+    valid until the next block is requested.
+
+    Arguments:
+        daq (zhinst.ziDAQServer) -- Data Server Object
+        paths (list) -- list of subscribed paths
+        num_samples (int) -- expected number of samples per path, 
+                             or size of the rings in continuous mode
+
+    Keyword Arguments:
+        timeout (float) -- time in seconds to get all the samples, or 
+                           between two blocks in continuous mode 
+                           (default: 10.0)
+        block_size (int) -- number of samples per block yielded by 
+                            `blocks`, has to divide num_samples in 
+                            continuous mode (default: num_samples)
+        continuous (bool) -- acquire into ring buffers without end 
+                             (default: False)
+    """
+
+    poll_length = 0.001  # s
+    poll_timeout = 500  # ms
+
+    def __init__(self, daq, paths, num_samples, timeout=10.0, block_size=None, continuous=False):
+        self.daq = daq
+        self.paths = list(paths)
+        self.num_samples = num_samples
+        self.timeout = timeout
+        self.block_size = block_size or num_samples
+        self.continuous = continuous
+        if continuous:
+            assert num_samples % self.block_size == 0, "The block size has to divide the number of samples!"
+
+        # allocated at the first chunk, with the data type of the path
+        self.buffers = {p: None for p in self.paths}
+        self.received = {p: 0 for p in self.paths}
+        # samples already yielded, that the ring buffers may overwrite
+        self._consumed = 0
+
+    def _write(self, path, vector):
+        vector = np.asarray(vector)
+        buffer = self.buffers[path]
+        if buffer is None:
+            buffer = self.buffers[path] = np.empty(self.num_samples, dtype=vector.dtype)
+        received = self.received[path]
+
+        if not self.continuous:
+            n = min(len(vector), self.num_samples - received)
+            buffer[received:received + n] = vector[:n]
+            self.received[path] = received + n
+            return
+
+        if received + len(vector) - self._consumed > self.num_samples:
+            raise Exception(f"Buffer overrun on {path}: blocks are not consumed fast enough, "
+                            "increase the number of samples of the ring!")
+        start = received % self.num_samples
+        n = min(len(vector), self.num_samples - start)
+        buffer[start:start + n] = vector[:n]
+        buffer[:len(vector) - n] = vector[n:]
+        self.received[path] = received + len(vector)
+
+    def poll(self):
+        """Polls the data server once and stores the samples received."""
+        dataset = self.daq.poll(self.poll_length, self.poll_timeout, 0, True)
+        for p in self.paths:
+            for v in dataset.get(p, ()):
+                self._write(p, v["vector"])
+
+    def _timeout(self, expected):
+        for p in self.paths:
+            print("Path {}: Got {} of {} samples".format(p, self.received[p], expected))
+        raise Exception("Timeout Error: Did not get all results within {:.1f} s!".format(self.timeout))
+
+    def blocks(self):
+        """
+        Generator yielding the blocks as soon as all the paths filled them.
+
+        Yields:
+            (dict) -- block of samples of each path, as array
+        """
+        block = 0
+        deadline = time.monotonic() + self.timeout
+        while True:
+            start = block * self.block_size
+            end = start + self.block_size
+            if not self.continuous:
+                if start >= self.num_samples:
+                    return
+                end = min(end, self.num_samples)
+
+            while min(self.received.values()) < end:
+                if time.monotonic() > deadline:
+                    self._timeout(end)
+                self.poll()
+
+            offset = start % self.num_samples
+            yield {p: self.buffers[p][offset:offset + end - start] for p in self.paths}
+            block += 1
+            self._consumed = end
+            if self.continuous:
+                deadline = time.monotonic() + self.timeout
+
+    def acquire(self):
+        """
+        Acquires all the samples.
+
+        Returns:
+            (dict) -- the samples of each path, as array
+        """
+        assert not self.continuous, "A continuous acquisition has no end!"
+        for _ in self.blocks():
+            pass
+        return self.buffers
+
+
 def acquisition_poll(daq, paths, num_samples, timeout=10.0):
     """ Polls the UHFQA for data. Taken from zhinst.examples.uhfqa.common
 
@@ -501,38 +1060,144 @@ def acquisition_poll(daq, paths, num_samples, timeout=10.0):
         num_samples (int): expected number of samples
         timeout (float): time in seconds before timeout Error is raised.
     """
-    poll_length = 0.001  # s
-    poll_timeout = 500  # ms
-    poll_flags = 0
-    poll_return_flat_dict = True
-
-    # Keep list of recorded chunks of data for each subscribed path
-    chunks = {p: [] for p in paths}
-    gotem = {p: False for p in paths}
-
-    # Poll data
-    time = 0
-    while time < timeout and not all(gotem.values()):
-        dataset = daq.poll(poll_length, poll_timeout, poll_flags, poll_return_flat_dict)
-        for p in paths:
-            if p not in dataset:
-                continue
-            for v in dataset[p]:
-                chunks[p].append(v['vector'])
-                num_obtained = sum([len(x) for x in chunks[p]])
-                if num_obtained >= num_samples:
-                    gotem[p] = True
-        time += poll_length
-
-    if not all(gotem.values()):
-        for p in paths:
-            num_obtained = sum([len(x) for x in chunks[p]])
-            print('Path {}: Got {} of {} samples'.format(p, num_obtained, num_samples))
-        raise Exception('Timeout Error: Did not get all results within {:.1f} s!'.format(timeout))
-
-    # Return dict of flattened data
-    return {p: np.concatenate(v) for p, v in chunks.items()}
+    return StreamingAcquisition(daq, paths, num_samples, timeout).acquire()
+
+
+
+class QAPipeline:
+    """
+    Processing of the UHFQA applied on the host to raw input traces: 
+    weighted integration, rotation, crosstalk correction and 
+    thresholding, as in the QA Setup tab. Batches of traces are 
+    processed as matrix products, in chunks of shots so that the 
+    memory used stays bounded, e.g. to analyze archived monitor traces 
+    again with new weights.
+
+    Keyword Arguments:
+        weights (complex array) -- integration weights (channels x samples), 
+                                   real part for input I and imaginary 
+                                   part for input Q (default: zeros)
+        rotations (complex) -- rotation of each channel (default: ones)
+        crosstalk (2D array) -- crosstalk matrix (default: identity)
+        thresholds (float) -- threshold level of each channel 
+                              (default: zeros)
+        chunk_size (int) -- number of shots processed at once 
+                            (default: 65536)
+    """
 
+    sources = ["integration", "rotation", "crosstalk", "threshold"]
+
+    def __init__(
+        self,
+        weights=None,
+        rotations=None,
+        crosstalk=None,
+        thresholds=None,
+        chunk_size=65536,
+    ):
+        self.weights = np.zeros((10, 4096), dtype=complex) if weights is None else np.asarray(weights, dtype=complex)
+        n_channels = len(self.weights)
+        self.rotations = np.ones(n_channels, dtype=complex) if rotations is None else np.asarray(rotations, dtype=complex)
+        self.crosstalk = np.eye(n_channels) if crosstalk is None else np.asarray(crosstalk, dtype=float)
+        self.thresholds = np.zeros(n_channels) if thresholds is None else np.asarray(thresholds, dtype=float)
+        self.chunk_size = chunk_size
+
+    @classmethod
+    def from_device(cls, daq, device, **kwargs):
+        """
+        Returns a pipeline with the integration weights and length last 
+        set on the device with set_integration_weights, and the given 
+        rotations, crosstalk matrix and thresholds.
+
+        Arguments:
+            daq (zhinst.ziDAQServer) -- Data Server Object
+            device (String) -- device ID, e.g. "dev2266"
+        """
+        mirror = _integration_mirror(daq, device)
+        length = mirror["length"] or 4096
+        weights = np.zeros((10, length), dtype=complex)
+        for (ch, quadrature), values in mirror["weights"].items():
+            if quadrature == "real":
+                weights[ch] += values[:length]
+            else:
+                weights[ch] += 1j * values[:length]
+        return cls(weights, **kwargs)
+
+    def _process_chunk(self, I, Q, source):
+        length = self.weights.shape[1]
+        I = np.asarray(I[:, :length], dtype=float)
+        Q = np.asarray(Q[:, :length], dtype=float)
+        # (shots, samples) x (samples, channels)
+        result = I @ self.weights[:, :I.shape[1]].real.T + 1j * (Q @ self.weights[:, :Q.shape[1]].imag.T)
+        return self.apply(result, source)
+
+    def apply(self, integrated, source="threshold"):
+        """
+        Applies the processing steps after the integration.
+
+        Arguments:
+            integrated (complex array) -- integrated results (shots x channels)
+
+        Keyword Arguments:
+            source (str) -- last processing step (default: "threshold")
+
+        Returns:
+            (array) -- results (shots x channels)
+        """
+        assert source in self.sources
+        result = integrated
+        if source == "integration":
+            return result
+        result = np.real(result * self.rotations)
+        if source == "rotation":
+            return result
+        result = result @ self.crosstalk.T
+        if source == "crosstalk":
+            return result
+        return (result > self.thresholds).astype(float)
+
+    def chunks(self, I, Q, source="threshold"):
+        """
+        Generator processing the traces chunk by chunk.
+
+        Arguments:
+            I (2D array) -- traces of input I (shots x samples), 
+                            may be a memory-mapped file
+            Q (2D array) -- traces of input Q (shots x samples)
+
+        Keyword Arguments:
+            source (str) -- last processing step, "integration", 
+                            "rotation", "crosstalk" or "threshold" 
+                            (default: "threshold")
+
+        Yields:
+            (array) -- results of a chunk (shots x channels)
+        """
+        assert source in self.sources
+        assert len(I) == len(Q), "I and Q need the same number of shots!"
+        for start in range(0, len(I), self.chunk_size):
+            stop = start + self.chunk_size
+            yield self._process_chunk(I[start:stop], Q[start:stop], source)
+
+    def process(self, I, Q, source="threshold"):
+        """
+        Processes all the traces, see chunks. A single trace per input 
+        is processed as one shot.
+
+        Returns:
+            (array) -- results (shots x channels), complex for 
+                       "integration", real otherwise
+        """
+        single = np.ndim(I) == 1
+        I = np.atleast_2d(I)
+        Q = np.atleast_2d(Q)
+        dtype = complex if source == "integration" else float
+        result = np.empty((len(I), len(self.weights)), dtype=dtype)
+        start = 0
+        for chunk in self.chunks(I, Q, source):
+            result[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        return result[0] if single else result
 
 
 if __name__ == "__name__":
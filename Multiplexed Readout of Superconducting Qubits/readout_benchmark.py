@@ -0,0 +1,193 @@
+# Copyright (C) 2026 Zurich Instruments
+#
+# This software may be modified and distributed under the terms
+# of the MIT license. See the LICENSE file for details.
+
+"""Throughput benchmark of the multiplexed readout helpers
+
+Runs the calibration of the integration weights, the acquisition of
+results and the host-side processing of shots against UHFQASimulator, so
+that no instrument is needed. The times of each benchmark are saved as
+`<name>.txt`, one value per line. Beforehand, the weights calibrated for
+all channels together are checked against the ones calibrated one
+channel at a time, also with one tone detuned from its readout
+frequency.
+"""
+
+import numpy as np
+import argparse, contextlib, io, os, time
+
+from multiplexed_readout_helpers import (
+    QAPipeline,
+    acquisition_poll,
+    compile_sequence,
+    optimal_integration_weights,
+    optimal_integration_weights_multiplexed,
+    run_awg,
+    sequence_multiplexed_readout,
+    set_qa_monitor,
+    set_qa_results,
+)
+from state_discrimination import StateDiscriminator, joint_states
+from uhfqa_simulator import UHFQASimulator
+
+FREQUENCIES = 1e6 * np.linspace(82.6, 119.7, 10)
+
+
+def _timed(function, *args, **kwargs):
+    """Runs the function without its printouts, returns the time in seconds"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def check_multiplexed_weights(channels=range(10), monitor_length=700, min_correlation=0.999, detunings=None):
+    """
+    Compares the integration weights calibrated for all channels together
+    with the ones calibrated one channel at a time, on a noise-free
+    simulator. Without detunings the traces follow the model of
+    separate_channels exactly; with detunings the received tones no
+    longer share the envelope, and the per-channel weights, which measure
+    each tone on its own, are the reference for the error of the model.
+
+    Keyword Arguments:
+        detunings (float) -- frequency offset (in Hz) of the tone received
+                             from each channel (default: None)
+
+    Returns:
+        (array) -- correlation of the weights I and Q of each channel
+    """
+    sim = UHFQASimulator(noise=0, detunings=detunings)
+    device = sim.device
+    awg = sim.awgModule()
+    set_qa_monitor(sim, device, monitor_length, 1)
+    channels = list(channels)
+    with contextlib.redirect_stdout(io.StringIO()):
+        multiplexed = optimal_integration_weights_multiplexed(sim, device, awg, channels, FREQUENCIES)
+    correlations = np.zeros((len(channels), 2))
+    for i, ch in enumerate(channels):
+        with contextlib.redirect_stdout(io.StringIO()):
+            optimal_integration_weights(sim, device, awg, ch, FREQUENCIES)
+        for j, quadrature in enumerate(["real", "imag"]):
+            path = f"/{device}/qas/0/integration/weights/{ch}/{quadrature}"
+            reference = sim.get(path)[path]["value"][:monitor_length]
+            weights = multiplexed[ch][j]
+            correlations[i, j] = abs(weights @ reference) / (np.linalg.norm(weights) * np.linalg.norm(reference))
+    assert np.all(correlations >= min_correlation), (
+        f"Multiplexed weights differ from the per-channel ones, correlations {correlations.min(axis=1)}"
+    )
+    return correlations
+
+
+def bench_optimal_weights(sim, n_channels, k, monitor_length=700, monitor_averages=2**10):
+    """
+    Times the calibration of the integration weights of 1 ... n_channels
+    channels, one channel at a time and multiplexed.
+
+    Returns:
+        (array, array) -- time of each iteration, per channel and multiplexed
+    """
+    device = sim.device
+    awg = sim.awgModule()
+    set_qa_monitor(sim, device, monitor_length, monitor_averages)
+    per_channel, multiplexed = [], []
+    for n in range(1, n_channels + 1):
+        for _ in range(k):
+            per_channel.append(_timed(
+                lambda: [optimal_integration_weights(sim, device, awg, ch, FREQUENCIES) for ch in range(n)]
+            ))
+            multiplexed.append(_timed(
+                optimal_integration_weights_multiplexed, sim, device, awg, range(n), FREQUENCIES
+            ))
+    return np.array(per_channel), np.array(multiplexed)
+
+
+def bench_acquisition(sim, n, k, n_channels=10):
+    """
+    Times the acquisition of results of 2^1 ... 2^n points from all
+    channels with acquisition_poll.
+
+    Returns:
+        (array) -- time of each iteration
+    """
+    device = sim.device
+    awg = sim.awgModule()
+    paths = [f"/{device}/qas/0/result/data/{ch}/wave" for ch in range(n_channels)]
+    times = []
+    for len_exp in range(1, n + 1):
+        result_length = 2**len_exp
+        set_qa_results(sim, device, result_length, 1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            compile_sequence(awg, sequence_multiplexed_readout(range(n_channels), FREQUENCIES, result_length))
+        for _ in range(k):
+            sim.subscribe(paths)
+            start = time.perf_counter()
+            run_awg(sim, device)
+            acquisition_poll(sim, paths, result_length)
+            times.append(time.perf_counter() - start)
+            sim.unsubscribe(paths)
+    return np.array(times)
+
+
+def bench_pipeline(n, k, samples=700, n_channels=10, seed=None):
+    """
+    Times the host-side processing of 2^10 ... 2^(n+9) shots of raw
+    traces to thresholded results, and the joint state assignment of the
+    same number of integrated shots.
+
+    Returns:
+        (array, array) -- time of each iteration, pipeline and assignment
+    """
+    rng = np.random.default_rng(seed)
+    pipeline = QAPipeline(rng.standard_normal((n_channels, samples)) + 1j * rng.standard_normal((n_channels, samples)))
+    ground = rng.standard_normal((1000, n_channels)) + 1j * rng.standard_normal((1000, n_channels))
+    discriminator = StateDiscriminator.fit(ground, ground + 2)
+    processing, assignment = [], []
+    for len_exp in range(10, n + 10):
+        shots = 2**len_exp
+        I = rng.standard_normal((shots, samples)).astype(np.float32)
+        Q = rng.standard_normal((shots, samples)).astype(np.float32)
+        integrated = pipeline.process(I, Q, "integration")
+        for _ in range(k):
+            processing.append(_timed(pipeline.process, I, Q))
+            assignment.append(_timed(lambda: joint_states(discriminator.classify(integrated))))
+    return np.array(processing), np.array(assignment)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=6, help="number of sizes")
+    parser.add_argument("-k", type=int, default=3, help="iterations per size")
+    parser.add_argument("--channels", type=int, default=5, help="channels calibrated, up to 10")
+    parser.add_argument("--latency", type=float, default=0.0, help="latency of a poll, in seconds")
+    parser.add_argument("--noise", type=float, default=0.01, help="input noise per sample")
+    parser.add_argument("--out", default=".", help="directory of the result files")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    correlations = check_multiplexed_weights()
+    print(f"multiplexed weights: correlation with per-channel weights >= {correlations.min():.6f}")
+    # one resonator 100 kHz off its readout frequency, outside the model
+    detunings = np.zeros(10)
+    detunings[3] = 100e3
+    correlations = check_multiplexed_weights(min_correlation=0.998, detunings=detunings)
+    print(f"  with channel 3 detuned by 100 kHz: correlation >= {correlations.min():.6f}")
+
+    sim = UHFQASimulator(noise=args.noise, latency=args.latency, seed=args.seed)
+    results = {}
+    results["weights_per_channel"], results["weights_multiplexed"] = bench_optimal_weights(
+        sim, args.channels, args.k
+    )
+    results["acquisition"] = bench_acquisition(sim, args.n, args.k)
+    results["pipeline"], results["assignment"] = bench_pipeline(args.n, args.k, seed=args.seed)
+
+    os.makedirs(args.out, exist_ok=True)
+    np.savetxt(os.path.join(args.out, "params.txt"), [args.n, args.k], fmt="%d")
+    for name, times in results.items():
+        np.savetxt(os.path.join(args.out, f"{name}.txt"), times)
+        print(f"{name:20s} mean {times.mean()*1e3:9.2f} ms   max {times.max()*1e3:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
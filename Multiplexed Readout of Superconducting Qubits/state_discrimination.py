@@ -0,0 +1,218 @@
+# Copyright (C) 2026 Zurich Instruments
+#
+# This software may be modified and distributed under the terms
+# of the MIT license. See the LICENSE file for details.
+
+import numpy as np
+
+
+class StateDiscriminator:
+    """
+    Single-shot discrimination of the ground and excited state of
+    several readout channels at once. Each channel has a linear
+    discriminant (LDA, shared covariance) or a quadratic one (QDA,
+    Gaussian mixture with a covariance per state), fitted to calibration
+    shots of the integrated I/Q results. Use `fit` to create it.
+
+    The linear discriminant of each channel is always kept: it is
+    equivalent to a rotation and a threshold of the UHFQA, see
+    `device_settings`.
+    """
+
+    methods = ["lda", "qda"]
+
+    def __init__(self, means, covariances, method="lda", chunk_size=2**18):
+        self.means = means
+        self.covariances = covariances
+        self.method = method
+        self.chunk_size = chunk_size
+
+        # linear discriminant: excited if w.x + b > 0
+        pooled = covariances.mean(axis=1)
+        self.w = np.linalg.solve(pooled, (means[:, 1] - means[:, 0])[..., None])[..., 0]
+        self.b = -np.einsum("ci,ci->c", self.w, means.mean(axis=1))
+
+        # quadratic discriminant: excited if x.A.x + c.x + d > 0
+        inverse = np.linalg.inv(covariances)
+        self.A = 0.5 * (inverse[:, 0] - inverse[:, 1])
+        self.c = np.einsum("cij,cj->ci", inverse[:, 1], means[:, 1]) - np.einsum(
+            "cij,cj->ci", inverse[:, 0], means[:, 0]
+        )
+        self.d = 0.5 * (
+            np.einsum("ci,cij,cj->c", means[:, 0], inverse[:, 0], means[:, 0])
+            - np.einsum("ci,cij,cj->c", means[:, 1], inverse[:, 1], means[:, 1])
+            + np.linalg.slogdet(covariances[:, 0])[1]
+            - np.linalg.slogdet(covariances[:, 1])[1]
+        )
+
+    @classmethod
+    def fit(cls, ground, excited, method="lda", regularization=1e-9, **kwargs):
+        """
+        Fits the discriminants of all channels to calibration shots.
+
+        Arguments:
+            ground (complex array) -- integrated results (shots x channels)
+                                      with all qubits in the ground state
+            excited (complex array) -- integrated results (shots x channels)
+                                       with all qubits in the excited state
+
+        Keyword Arguments:
+            method (str) -- "lda" or "qda" (default: "lda")
+            regularization (float) -- added to the covariances, relative to
+                                      their trace, so that real-valued
+                                      results can be used (default: 1e-9)
+
+        Returns:
+            (StateDiscriminator) -- the fitted discriminator
+        """
+        assert method in cls.methods
+        means = []
+        covariances = []
+        for shots in [ground, excited]:
+            x = _features(np.asarray(shots).reshape(len(shots), -1))
+            mean = x.mean(axis=0)
+            centered = x - mean
+            covariance = np.einsum("sci,scj->cij", centered, centered) / max(len(x) - 1, 1)
+            trace = np.trace(covariance, axis1=1, axis2=2)
+            covariance += (regularization * trace + np.finfo(float).tiny)[:, None, None] * np.eye(2)
+            means.append(mean)
+            covariances.append(covariance)
+        # (channels, states, ...)
+        return cls(np.stack(means, axis=1), np.stack(covariances, axis=1), method, **kwargs)
+
+    def _scores(self, shots):
+        x = _features(shots)
+        if self.method == "lda":
+            return np.einsum("sci,ci->sc", x, self.w) + self.b
+        return np.einsum("sci,cij,scj->sc", x, self.A, x) + np.einsum("sci,ci->sc", x, self.c) + self.d
+
+    def classify(self, shots):
+        """
+        Assigns the state of every shot and channel, in chunks of shots.
+
+        Arguments:
+            shots (complex array) -- integrated results (shots x channels)
+
+        Returns:
+            (bool array) -- True for the excited state (shots x channels)
+        """
+        shots = np.asarray(shots)
+        states = np.empty(shots.shape, dtype=bool)
+        for start in range(0, len(shots), self.chunk_size):
+            stop = start + self.chunk_size
+            states[start:stop] = self._scores(shots[start:stop]) > 0
+        return states
+
+    def confusion_matrices(self, ground, excited):
+        """
+        Returns the probability of each assigned state given the prepared
+        one, for every channel.
+
+        Arguments:
+            ground (complex array) -- results (shots x channels) in the ground state
+            excited (complex array) -- results (shots x channels) in the excited state
+
+        Returns:
+            (array) -- P(assigned | prepared), shape (channels, prepared, assigned)
+        """
+        p_excited = np.stack([self.classify(ground).mean(axis=0), self.classify(excited).mean(axis=0)], axis=1)
+        return np.stack([1 - p_excited, p_excited], axis=2)
+
+    def device_settings(self):
+        """
+        Returns the rotation and threshold of each channel equivalent to
+        the linear discriminant: the state is excited if
+        real(rotation * result) > threshold. Valid with the identity as
+        crosstalk matrix.
+
+        Returns:
+            (complex array, float array) -- rotations and thresholds
+        """
+        w = self.w[:, 0] + 1j * self.w[:, 1]
+        norm = np.abs(w)
+        return np.conj(w) / norm, -self.b / norm
+
+    def write(self, daq, device, channels=None):
+        """
+        Writes the rotations and thresholds to the QA Setup tab of the
+        UHFQA in a single transaction.
+
+        Arguments:
+            daq (zhinst.ziDAQServer) -- Data Server Object
+            device (String) -- device ID, e.g. "dev2266"
+
+        Keyword Arguments:
+            channels (int) -- indices of the channels on the device, in the
+                              order of the columns of the results
+                              (default: 0, 1, ...)
+        """
+        rotations, thresholds = self.device_settings()
+        if channels is None:
+            channels = range(len(rotations))
+        settings = []
+        for ch, rotation, threshold in zip(channels, rotations, thresholds):
+            settings.append((f"/{device}/qas/0/rotations/{ch}", complex(rotation)))
+            settings.append((f"/{device}/qas/0/thresholds/{ch}/level", float(threshold)))
+        daq.set(settings)
+
+
+def _features(shots):
+    """Integrated results (shots x channels) as real features (shots x channels x 2)"""
+    shots = np.asarray(shots)
+    return np.stack([shots.real, shots.imag], axis=-1).astype(float, copy=False)
+
+
+def joint_states(states):
+    """
+    Returns the joint state of all channels of every shot as integer,
+    the first channel being the most significant bit.
+
+    Arguments:
+        states (bool array) -- state of each channel (shots x channels),
+                               up to 16 channels
+
+    Returns:
+        (int array) -- joint state of every shot
+    """
+    states = np.asarray(states)
+    n_channels = states.shape[-1]
+    assert n_channels <= 16
+    bits = (1 << np.arange(n_channels - 1, -1, -1)).astype(np.uint16)
+    return states.astype(np.uint16) @ bits
+
+
+def assignment_matrix(prepared, assigned, n_channels):
+    """
+    Returns the assignment matrix of the joint states: the probability
+    of each assigned state (columns) given the prepared one (rows).
+
+    Arguments:
+        prepared (int array) -- prepared joint state of every shot
+        assigned (int array) -- assigned joint state of every shot,
+                                e.g. from joint_states
+        n_channels (int) -- number of channels
+
+    Returns:
+        (2D array) -- 2^N x 2^N assignment matrix, rows without shots are 0
+    """
+    n_states = 2**n_channels
+    prepared = np.broadcast_to(prepared, np.shape(assigned)).astype(np.int64)
+    counts = np.bincount(prepared * n_states + assigned, minlength=n_states**2)
+    counts = counts.reshape(n_states, n_states).astype(float)
+    totals = counts.sum(axis=1, keepdims=True)
+    return np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+
+
+def assignment_fidelity(matrix):
+    """
+    Returns the assignment fidelity, the average probability of assigning
+    the prepared state, over the prepared states with shots.
+
+    Arguments:
+        matrix (2D array) -- assignment matrix
+
+    Returns:
+        (float) -- assignment fidelity
+    """
+    measured = matrix.sum(axis=1) > 0
+    return float(np.mean(np.diag(matrix)[measured]))
@@ -0,0 +1,377 @@
+# Copyright (C) 2026 Zurich Instruments
+#
+# This software may be modified and distributed under the terms
+# of the MIT license. See the LICENSE file for details.
+
+import numpy as np
+import re
+import threading
+import time
+from scipy.special import ndtr
+
+from multiplexed_readout_helpers import QAPipeline
+
+
+def parse_readout_sequence(awg_program):
+    """
+    Extracts the readout tones from a program generated by
+    sequence_multiplexed_readout.
+
+    Arguments:
+        awg_program (String) -- awg sequence program
+
+    Returns:
+        (dict) -- constants of the envelope, "tones" as list of
+                  (frequency, amplitude, phase), "channels" of the
+                  tones and "repetitions"
+    """
+    constants = {
+        name: float(value)
+        for name, value in re.findall(r"const (\w+) = ([-+\d.eE]+);", awg_program)
+    }
+    frequencies = dict(re.findall(r"const f(\d+)_readout = (\S+) ;", awg_program))
+    pulses = re.findall(
+        r"wave w(\d+)_I =  (\S+) \* readoutPulse \* cosine\(totalLength, 1, (\S+), ", awg_program
+    )
+    tones = [(float(frequencies[ch]), float(amplitude), float(phase)) for ch, amplitude, phase in pulses]
+    repetitions = int(re.search(r"var result_averages = (\d+) ;", awg_program).group(1))
+    channels = [int(ch) for ch, _, _ in pulses]
+    return {"constants": constants, "tones": tones, "channels": channels, "repetitions": repetitions}
+
+
+def readout_waveforms(sequence, detunings=None):
+    """
+    Returns the I and Q waveforms played by a program parsed with
+    parse_readout_sequence, as computed by the sequencer.
+
+    Arguments:
+        sequence (dict) -- parsed program
+
+    Keyword Arguments:
+        detunings (float) -- frequency offset (in Hz) added to each tone,
+                             in the order of the tones (default: None)
+
+    Returns:
+        (array, array) -- waveforms I and Q
+    """
+    c = sequence["constants"]
+    fs = c["samplingRate"]
+    rise = int(c["riseTime"] * fs)
+    fall = int(c["fallTime"] * fs)
+    length = int(c["flatTime"] * fs)
+    total = rise + length + fall
+
+    def gauss(n, position, width):
+        return np.exp(-((np.arange(n) - position) ** 2) / (2 * width**2))
+
+    envelope = np.concatenate([
+        gauss(2 * rise, rise, rise / 4)[:rise + 1],
+        np.ones(length),
+        gauss(2 * fall, fall, fall / 4)[fall:2 * fall],
+        np.zeros((total - 1) % 16),
+    ])[:total]
+    n = np.arange(total)
+    wave_I = np.zeros(total)
+    wave_Q = np.zeros(total)
+    if detunings is None:
+        detunings = np.zeros(len(sequence["tones"]))
+    for (frequency, amplitude, phase), detuning in zip(sequence["tones"], detunings):
+        frequency += detuning
+        argument = 2 * np.pi * frequency * n / fs + phase
+        wave_I += amplitude * envelope * np.cos(argument)
+        wave_Q += amplitude * envelope * np.sin(argument)
+    return wave_I, wave_Q
+
+
+class SimulatedAWGModule:
+    """
+    Stand-in for the awgModule of the simulated UHFQA. Compilation parses
+    the readout program and takes `compile_time` seconds.
+    """
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+        self.params = {"compiler/status": -1, "compiler/statusstring": "", "device": "", "index": 0}
+
+    def execute(self):
+        pass
+
+    def set(self, name, value):
+        self.params[name] = value
+        if name == "compiler/sourcestring":
+            time.sleep(self.simulator.compile_time)
+            try:
+                self.simulator.load_program(value)
+                self.params["compiler/status"] = 0
+            except Exception as e:
+                self.params["compiler/status"] = 1
+                self.params["compiler/statusstring"] = str(e)
+
+    def get(self, name):
+        return self.params[name]
+
+    def getInt(self, name):
+        return int(self.params[name])
+
+    def getString(self, name):
+        return str(self.params[name])
+
+
+class UHFQASimulator:
+    """
+    Stand-in for the data server with a UHFQA whose outputs are connected
+    to its inputs, as in the tabletop demonstration. Running the AWG plays
+    the readout program generated by sequence_multiplexed_readout: the
+    monitor traces are the played waveforms with Gaussian noise, and the
+    results are processed with the integration weights, rotations,
+    crosstalk matrix and thresholds set on the nodes.
+
+    The noise of the averaged monitor traces and of the results is drawn
+    for the averages directly; for thresholded results the channels are
+    drawn independently.
+
+    Keyword Arguments:
+        device (String) -- device ID (default: "dev2266")
+        noise (float) -- standard deviation of the input noise per sample
+                         (default: 0.01)
+        latency (float) -- time in seconds added to every poll (default: 0)
+        shot_time (float) -- duration of one repetition of the program, in
+                             seconds (default: 1e-6)
+        compile_time (float) -- duration of a compilation (default: 0)
+        chunk_size (int) -- number of samples per polled chunk
+                            (default: None, whole vectors)
+        seed (int) -- seed of the noise (default: None)
+        detunings (float) -- frequency offset (in Hz) of the tone received
+                             from each channel, as from a readout resonator
+                             off the readout frequency; the tones then no
+                             longer share the envelope (default: None)
+    """
+
+    def __init__(
+        self,
+        device="dev2266",
+        noise=0.01,
+        latency=0.0,
+        shot_time=1e-6,
+        compile_time=0.0,
+        chunk_size=None,
+        seed=None,
+        detunings=None,
+    ):
+        self.device = device.lower()
+        self.noise = noise
+        self.latency = latency
+        self.shot_time = shot_time
+        self.compile_time = compile_time
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
+        self.detunings = np.zeros(10) if detunings is None else np.asarray(detunings, dtype=float)
+        self.sequence = None
+        self.runs = 0
+
+        d = f"/{self.device}/qas/0"
+        self.nodes = {
+            f"{d}/monitor/length": 4096,
+            f"{d}/monitor/averages": 1,
+            f"{d}/integration/length": 4096,
+            f"{d}/result/length": 100,
+            f"{d}/result/averages": 1,
+            f"{d}/result/source": 7,
+        }
+        for ch in range(10):
+            self.nodes[f"{d}/rotations/{ch}"] = 1 + 0j
+            self.nodes[f"{d}/thresholds/{ch}/level"] = 0.0
+            for quadrature in ["real", "imag"]:
+                self.nodes[f"{d}/integration/weights/{ch}/{quadrature}"] = np.zeros(4096)
+            for c in range(10):
+                self.nodes[f"{d}/crosstalk/rows/{ch}/cols/{c}"] = float(ch == c)
+
+        self._subscribed = set()
+        # data of the subscribed paths, as (time available, path, vector)
+        self._events = []
+        self._lock = threading.Lock()
+
+    def _node(self, path):
+        return self.nodes.get(path.lower(), 0)
+
+    def _write(self, path, value):
+        path = path.lower()
+        if "/integration/weights/" in path:
+            # vectors are written from the start of the memory
+            value = np.asarray(value, dtype=float)
+            memory = self.nodes[path].copy()
+            memory[:len(value)] = value
+            value = memory
+        self.nodes[path] = value
+        if path == f"/{self.device}/awgs/0/enable" and value == 1:
+            self._run()
+
+    def load_program(self, awg_program):
+        sequence = parse_readout_sequence(awg_program)
+        sequence["waves"] = readout_waveforms(sequence, self.detunings[sequence["channels"]])
+        self.sequence = sequence
+
+    def pipeline(self):
+        """Processing of the results as currently set on the nodes"""
+        d = f"/{self.device}/qas/0"
+        length = int(self._node(f"{d}/integration/length"))
+        weights = np.array([
+            self._node(f"{d}/integration/weights/{ch}/real")[:length]
+            + 1j * self._node(f"{d}/integration/weights/{ch}/imag")[:length]
+            for ch in range(10)
+        ])
+        return QAPipeline(
+            weights,
+            rotations=[self._node(f"{d}/rotations/{ch}") for ch in range(10)],
+            crosstalk=[[self._node(f"{d}/crosstalk/rows/{r}/cols/{c}") for c in range(10)] for r in range(10)],
+            thresholds=[self._node(f"{d}/thresholds/{ch}/level") for ch in range(10)],
+        )
+
+    def _run(self):
+        self.runs += 1
+        self.nodes[f"/{self.device}/awgs/0/enable"] = 0
+        if self.sequence is None:
+            return
+        d = f"/{self.device}/qas/0"
+        repetitions = self.sequence["repetitions"]
+        wave_I, wave_Q = self.sequence["waves"]
+        start = time.monotonic()
+
+        # monitor: average of the input traces
+        length = int(self._node(f"{d}/monitor/length"))
+        averages = int(self._node(f"{d}/monitor/averages"))
+        if repetitions >= averages:
+            sigma = self.noise / np.sqrt(averages)
+            traces = []
+            for wave in [wave_I, wave_Q]:
+                trace = np.zeros(length)
+                n = min(length, len(wave))
+                trace[:n] = wave[:n]
+                traces.append(trace + sigma * self.rng.standard_normal(length))
+            ready = start + averages * self.shot_time
+            for i, trace in enumerate(traces):
+                self._emit(ready, f"{d}/monitor/inputs/{i}/wave", trace)
+
+        # results: integration of the clean traces, noise of the average
+        length = int(self._node(f"{d}/result/length"))
+        averages = int(self._node(f"{d}/result/averages"))
+        if repetitions >= length * averages:
+            source = {7: "integration", 2: "rotation", 0: "crosstalk", 1: "threshold"}[int(self._node(f"{d}/result/source"))]
+            pipeline = self.pipeline()
+            n = min(pipeline.weights.shape[1], len(wave_I))
+            clean_I = np.zeros(pipeline.weights.shape[1])
+            clean_Q = np.zeros(pipeline.weights.shape[1])
+            clean_I[:n] = wave_I[:n]
+            clean_Q[:n] = wave_Q[:n]
+            clean = pipeline.process(clean_I, clean_Q, "integration")
+
+            # correlated noise of the integrated channels, from the input noise
+            W = pipeline.weights
+            cov_real = self.noise**2 * (W.real @ W.real.T)
+            cov_imag = self.noise**2 * (W.imag @ W.imag.T)
+            if source == "threshold":
+                # probability of each channel to be above threshold in a shot
+                rotated = np.real(clean * pipeline.rotations)
+                R = np.real(pipeline.rotations)[:, None] * W.real
+                I = -np.imag(pipeline.rotations)[:, None] * W.imag
+                cov = pipeline.crosstalk @ (self.noise**2 * (R @ R.T + I @ I.T)) @ pipeline.crosstalk.T
+                mean = pipeline.crosstalk @ rotated
+                std = np.sqrt(np.maximum(np.diag(cov), 1e-300))
+                p = ndtr((mean - pipeline.thresholds) / std)
+                results = self.rng.binomial(averages, p, size=(length, len(p))) / averages
+            else:
+                noise = (
+                    self._correlated(cov_real, length) + 1j * self._correlated(cov_imag, length)
+                ) / np.sqrt(averages)
+                results = pipeline.apply(clean + noise, source)
+            ready = start + length * averages * self.shot_time
+            for ch in range(results.shape[1]):
+                self._emit(ready, f"{d}/result/data/{ch}/wave", results[:, ch])
+
+    def _correlated(self, covariance, n):
+        # covariance may be singular (unused channels), use its eigenvectors
+        values, vectors = np.linalg.eigh(covariance)
+        factor = vectors * np.sqrt(np.maximum(values, 0))
+        return self.rng.standard_normal((n, len(values))) @ factor.T
+
+    def _emit(self, ready, path, vector):
+        if path not in self._subscribed:
+            return
+        step = self.chunk_size or len(vector)
+        with self._lock:
+            for start in range(0, len(vector), step):
+                self._events.append((ready, path, vector[start:start + step]))
+
+    # data server interface used by the helpers
+
+    def connectDevice(self, device, interface):
+        pass
+
+    def awgModule(self):
+        return SimulatedAWGModule(self)
+
+    def set(self, path, value=None):
+        settings = [(path, value)] if value is not None else path
+        for p, v in settings:
+            self._write(p, v)
+
+    def setInt(self, path, value):
+        self._write(path, int(value))
+
+    def setDouble(self, path, value):
+        self._write(path, float(value))
+
+    def setComplex(self, path, value):
+        self._write(path, complex(value))
+
+    def setVector(self, path, value):
+        self._write(path, value)
+
+    def asyncSetInt(self, path, value):
+        self._write(path, int(value))
+
+    def syncSetInt(self, path, value):
+        self._write(path, int(value))
+        return int(value)
+
+    def getInt(self, path):
+        return int(np.real(self._node(path)))
+
+    def getDouble(self, path):
+        return float(np.real(self._node(path)))
+
+    def get(self, path, flat=True):
+        path = path.lower()
+        return {
+            p: {"timestamp": np.array([0]), "value": np.atleast_1d(v)}
+            for p, v in self.nodes.items()
+            if p.startswith(path)
+        }
+
+    def sync(self):
+        pass
+
+    def flush(self):
+        with self._lock:
+            self._events = []
+
+    def subscribe(self, paths):
+        paths = [paths] if isinstance(paths, str) else paths
+        self._subscribed.update(p.lower() for p in paths)
+
+    def unsubscribe(self, paths):
+        paths = [paths] if isinstance(paths, str) else paths
+        self._subscribed.difference_update(p.lower() for p in paths)
+        with self._lock:
+            self._events = [e for e in self._events if e[1] in self._subscribed]
+
+    def poll(self, recording_time, timeout, flags=0, flat=True):
+        time.sleep(recording_time + self.latency)
+        now = time.monotonic()
+        with self._lock:
+            ready = [e for e in self._events if e[0] <= now]
+            self._events = [e for e in self._events if e[0] > now]
+        data = {}
+        for _, path, vector in ready:
+            data.setdefault(path, []).append({"vector": vector})
+        return data
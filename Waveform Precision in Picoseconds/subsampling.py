@@ -5,8 +5,18 @@ Copyright (C) 2026 Zurich Instruments
 This software may be modified and distributed under the terms of the MIT license. See the LICENSE file for details.
 """
 
+from functools import lru_cache
+
 import numpy as np
 
+# Minimum delay in samples using the FIR filter
+MIN_DELAY_SAMPLES = 3.5
+# The maximum delay is given by the digital delay (port delay)
+MAX_DELAY_SAMPLES = 62 + MIN_DELAY_SAMPLES
+# Taps of the precompensation FIR filter, only the first 8 are used for the fine delay
+FIR_TAPS = 40
+FINE_DELAY_TAPS = 8
+
 
 def fractional_delay_filter(
     mu: float, fs_hz: float, f_bw_hz: float, N: int, beta: float = 6.0
@@ -62,6 +72,109 @@ def fractional_delay_filter(
     return h, tau_g_samples
 
 
+class FarrowDelayFilter:
+    """Farrow (polynomial) structure of the fractional delay filter.
+
+    The taps of `fractional_delay_filter` are approximated by polynomials in mu,
+    fitted once for given fs_hz, f_bw_hz, N and beta. Each filter is then obtained
+    by evaluating the polynomials, without any window or sinc evaluation.
+    The order is increased until the largest tap error over a dense grid of mu,
+    compared to the direct design, is below `tol`.
+
+    Attributes:
+        coefficients (np.array): polynomial coefficients, shape (order + 1, N),
+                                 in powers of 2*mu
+        order (int): order of the polynomials
+        max_error (float): largest tap error compared to `fractional_delay_filter`
+    """
+
+    def __init__(
+        self,
+        fs_hz: float,
+        f_bw_hz: float,
+        N: int,
+        beta: float = 6.0,
+        tol: float = 1e-9,
+        max_order: int = 24,
+    ):
+        """
+        Args:
+            fs_hz (float): sampling rate in Hz
+            f_bw_hz (float): cutoff frequency in Hz (must be 0 < f_bw_hz < fs_hz/2)
+            N (int): Length of the FIR filter
+            beta (float, optional): Kaiser window beta. Defaults to 6.0.
+            tol (float, optional): maximum tap error. Defaults to 1e-9.
+            max_order (int, optional): highest order tried. Defaults to 24.
+
+        Raises:
+            ValueError: If one or more parameters are out of bounds, or if the
+                        tolerance is not reached with max_order
+        """
+        self.N = N
+
+        # direct designs on a dense grid, to fit and to check the accuracy
+        mu_check = np.linspace(-0.5, 0.5, 1001)
+        h_check = np.array([fractional_delay_filter(mu, fs_hz, f_bw_hz, N, beta)[0] for mu in mu_check])
+
+        for order in range(2, max_order + 1):
+            # fit on Chebyshev nodes, in x = 2*mu in [-1, 1] for a good conditioning
+            x_fit = np.cos(np.pi * (np.arange(2 * (order + 1)) + 0.5) / (2 * (order + 1)))
+            h_fit = np.array([fractional_delay_filter(x / 2, fs_hz, f_bw_hz, N, beta)[0] for x in x_fit])
+            V = np.vander(x_fit, order + 1, increasing=True)
+            coefficients = np.linalg.lstsq(V, h_fit, rcond=None)[0]
+
+            V_check = np.vander(2 * mu_check, order + 1, increasing=True)
+            max_error = np.max(np.abs(V_check @ coefficients - h_check))
+            if max_error <= tol:
+                break
+        else:
+            raise ValueError(f"The tolerance {tol} is not reached with polynomials of order {max_order}.")
+
+        self.coefficients = coefficients
+        self.order = order
+        self.max_error = max_error
+        self._exponents = np.arange(order + 1)
+
+    def fir(self, mu: float) -> tuple[np.array, float]:
+        """Evaluate the fractional delay filter, as `fractional_delay_filter`.
+
+        Args:
+            mu (float or np.array): fractional delay in samples (must be -0.5 <= mu <= 0.5).
+                                    For an array, all the filters are evaluated at once.
+
+        Raises:
+            ValueError: If mu is out of bounds
+
+        Returns:
+            fir (np.array): FIR filter array, of shape mu.shape + (N,)
+            tau_g_samples (float or np.array): the group delay in samples
+        """
+        if not np.all((-0.5 <= mu) & (mu <= 0.5)):
+            raise ValueError(
+                "mu should be in [-0.5, 0.5] after separating the integer delay."
+            )
+        h = (2.0 * np.asarray(mu))[..., None] ** self._exponents @ self.coefficients
+        return h, (self.N - 1) / 2.0 + mu
+
+
+@lru_cache(maxsize=32)
+def farrow_filter(
+    fs_hz: float, f_bw_hz: float, N: int, beta: float = 6.0
+) -> FarrowDelayFilter:
+    """Get the Farrow filter for the given parameters, designed once and cached.
+
+    Args:
+        fs_hz (float): sampling rate in Hz
+        f_bw_hz (float): cutoff frequency in Hz (must be 0 < f_bw_hz < fs_hz/2)
+        N (int): Length of the FIR filter
+        beta (float, optional): Kaiser window beta. Defaults to 6.0.
+
+    Returns:
+        FarrowDelayFilter: the cached filter
+    """
+    return FarrowDelayFilter(fs_hz, f_bw_hz, N, beta)
+
+
 def get_delay_settings(
     delay: float, fs_hz: float, f_bw_hz: float = 900e6, beta: float = 6.0
 ) -> tuple[float, np.array, float]:
@@ -84,10 +197,8 @@ def get_delay_settings(
         tau_g_samples (float): the group delay in seconds
     """
 
-    # Minimum delay using the FIR filter
-    min_delay = 3.5
-    # The maximum delay is given by the digital delay (port delay)
-    max_delay = 62 + min_delay
+    min_delay = MIN_DELAY_SAMPLES
+    max_delay = MAX_DELAY_SAMPLES
 
     if not (min_delay <= delay * fs_hz <= max_delay):
         raise ValueError(
@@ -99,11 +210,135 @@ def get_delay_settings(
     mu = ((delay * fs_hz) % 1.0) - 0.5
 
     # Calculate the FIR filter for the fine delay. Only the first 8 taps are used, the other are set to zero
-    fir, tau_g = fractional_delay_filter(mu, fs_hz, f_bw_hz, 8, beta)
-    fir = np.concatenate((fir, np.zeros(32)))
+    # The filter is evaluated from its Farrow structure, designed once for these parameters
+    fir, tau_g = farrow_filter(fs_hz, f_bw_hz, FINE_DELAY_TAPS, beta).fir(mu)
+    fir = np.concatenate((fir, np.zeros(FIR_TAPS - FINE_DELAY_TAPS)))
 
     # The coarse (port) delay
     # We subtract the group delay introduced by the FIR filter
     port_delay = delay - tau_g / fs_hz
 
     return port_delay, fir, tau_g / fs_hz
+
+
+def get_delay_settings_batch(
+    delays: np.ndarray, fs_hz: float, f_bw_hz: float = 900e6, beta: float = 6.0
+) -> tuple[np.array, np.array, np.array]:
+    """Get the device parameters for many outputs at once, as `get_delay_settings`.
+
+    Args:
+        delays (np.array): The desired delays in seconds, of any shape,
+                           e.g. (channels, devices)
+        fs_hz (float): sampling rate in Hz
+        f_bw_hz (float, optional): cutoff frequency in Hz (must be 0 < f_bw_hz < fs_hz/2)
+                                   Defaults to 900e6.
+        beta (float, optional): Kaiser window beta (≈5–8 typical). Defaults to 6.0.
+
+    Raises:
+        ValueError: If one or more delays are out of bounds, listing all of them
+
+    Returns:
+        port_delays (np.array): the port (node) delays in seconds, of the shape of delays
+        firs (np.array): FIR filter arrays, of shape delays.shape + (40,)
+        tau_g (np.array): the group delays in seconds, of the shape of delays
+    """
+    delays = np.asarray(delays, dtype=float)
+    samples = delays * fs_hz
+
+    invalid = ~((MIN_DELAY_SAMPLES <= samples) & (samples <= MAX_DELAY_SAMPLES))
+    if np.any(invalid):
+        raise ValueError(
+            f"Delay must be larger than {MIN_DELAY_SAMPLES / fs_hz * 1e9:.2f} ns and smaller than "
+            f"{MAX_DELAY_SAMPLES / fs_hz * 1e9:.2f} ns, not at indices {np.argwhere(invalid).tolist()}."
+        )
+
+    # Fraction of sample of required shift of fine delay, in -0.5, 0.5
+    mu = (samples % 1.0) - 0.5
+
+    # All the fine delay filters at once, in the first taps of the FIR filters
+    fine, tau_g = farrow_filter(fs_hz, f_bw_hz, FINE_DELAY_TAPS, beta).fir(mu)
+    firs = np.zeros(delays.shape + (FIR_TAPS,))
+    firs[..., :FINE_DELAY_TAPS] = fine
+
+    port_delays = delays - tau_g / fs_hz
+
+    return port_delays, firs, tau_g / fs_hz
+
+
+def write_delay_settings(
+    daq, devices: list[str], port_delays: np.ndarray, firs: np.ndarray, sigouts: list[int] = None
+) -> None:
+    """Write the port delays and precompensation FIR filters of many outputs in a single set.
+
+    Args:
+        daq (zhinst.core.ziDAQServer): connection to the data server,
+                                       e.g. `session.daq_server` of zhinst-toolkit
+        devices (list[str]): the device serials, one per column of port_delays
+        port_delays (np.array): port delays in seconds, shape (channels, devices)
+        firs (np.array): FIR filters, shape (channels, devices, 40)
+        sigouts (list[int], optional): the signal output of each row of port_delays.
+                                       Defaults to 0, 1, ...
+    """
+    port_delays = np.asarray(port_delays, dtype=float).reshape(-1, len(devices))
+    firs = np.asarray(firs, dtype=float).reshape(port_delays.shape + (-1,))
+    if sigouts is None:
+        sigouts = range(port_delays.shape[0])
+
+    settings = []
+    for i, sigout in enumerate(sigouts):
+        for j, device in enumerate(devices):
+            node = f"/{device}/sigouts/{sigout}"
+            settings += [
+                (f"{node}/delay", port_delays[i, j]),
+                (f"{node}/precompensation/enable", 1),
+                (f"{node}/precompensation/fir/enable", 1),
+                (f"{node}/precompensation/fir/coefficients", firs[i, j]),
+            ]
+    daq.set(settings)
+
+
+def check_accuracy(fs_hz: float = 2.4e9, f_bw_hz: float = 900e6, n_delays: int = 2001, tol: float = 1e-9) -> float:
+    """Check the delay settings against the direct filter design, over the whole delay range.
+
+    The scalar and batch APIs must give the same settings, and the fine delay taps
+    must be within tol of `fractional_delay_filter`.
+
+    Args:
+        fs_hz (float, optional): sampling rate in Hz. Defaults to 2.4e9.
+        f_bw_hz (float, optional): cutoff frequency in Hz. Defaults to 900e6.
+        n_delays (int, optional): number of delays checked. Defaults to 2001.
+        tol (float, optional): maximum tap error. Defaults to 1e-9.
+
+    Raises:
+        AssertionError: If a check fails
+
+    Returns:
+        max_error (float): the largest tap error
+    """
+    # stay clear of the bounds, where rounding of delay * fs_hz could fall outside
+    margin = 1e-9
+    delays = np.linspace(MIN_DELAY_SAMPLES + margin, MAX_DELAY_SAMPLES - margin, n_delays) / fs_hz
+    port_delays, firs, tau_gs = get_delay_settings_batch(delays, fs_hz, f_bw_hz)
+
+    max_error = 0.0
+    for delay, port_delay_batch, fir_batch, tau_g_batch in zip(delays, port_delays, firs, tau_gs):
+        port_delay, fir, tau_g = get_delay_settings(delay, fs_hz, f_bw_hz)
+        assert np.isclose(port_delay, port_delay_batch, rtol=0, atol=1e-18), "port delays of the batch differ"
+        assert np.isclose(tau_g, tau_g_batch, rtol=0, atol=1e-18), "group delays of the batch differ"
+        assert np.allclose(fir, fir_batch, rtol=0, atol=1e-12), "filters of the batch differ"
+        assert not np.any(fir[FINE_DELAY_TAPS:]), "taps beyond the fine delay taps are set"
+
+        # baseline: the filter designed directly
+        mu = ((delay * fs_hz) % 1.0) - 0.5
+        exact, tau_g_exact = fractional_delay_filter(mu, fs_hz, f_bw_hz, FINE_DELAY_TAPS)
+        assert np.isclose(port_delay, delay - tau_g_exact / fs_hz, rtol=0, atol=1e-18), "port delay differs"
+        max_error = max(max_error, np.max(np.abs(fir[:FINE_DELAY_TAPS] - exact)))
+
+    assert max_error < tol, f"tap error {max_error:.2e} above {tol:.0e}"
+    return max_error
+
+
+if __name__ == "__main__":
+    # HDAWG and SHFSG sampling rates
+    for fs_hz in [2.4e9, 2.0e9]:
+        print(f"fs = {fs_hz / 1e9:.1f} GHz: max tap error {check_accuracy(fs_hz):.2e}")